@@ -0,0 +1,182 @@
+"""Replay traffic captured by TrafficCaptureMiddleware against a local instance.
+
+    python replay_traffic.py captures/traffic-*.ndjson* --base-url http://localhost:8001 --speed 10 --concurrency 32
+
+Requests are re-issued on the captured timeline divided by --speed. Each user
+pseudonym gets its own throwaway account, so per-user state (limits, spins)
+behaves as in the capture. Ids in route paths and body/query values were never
+recorded, so they are filled with placeholders; requests that needed a real
+id will mostly fail fast, but the route mix and arrival pattern are preserved.
+Latency is reported per route next to the latency recorded at capture time.
+"""
+import argparse
+import glob
+import json
+import re
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PLACEHOLDERS = {'num': 1, 'str': 'replay', 'bool': True, 'null': None}
+
+
+def load_capture(patterns):
+    records = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path) as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        records.append(json.loads(line))
+    # Unmatched routes were recorded without a path, so there is nothing to replay
+    records = [record for record in records if record.get('r')]
+    records.sort(key=lambda record: record['t'])
+    return records
+
+
+def fill_shape(shape):
+    if isinstance(shape, dict):
+        return {key: fill_shape(value) for key, value in shape.items()}
+    if isinstance(shape, list):
+        return [fill_shape(shape[0])] if shape else []
+    return PLACEHOLDERS.get(shape, 'replay')
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(fraction * (len(values) - 1))))]
+
+
+class Replayer:
+    def __init__(self, base_url, password, admin_token=None, timeout=30, concurrency=16):
+        self.base_url = base_url.rstrip('/')
+        self.password = password
+        self.admin_token = admin_token
+        self.timeout = timeout
+        self.tokens = {}
+        # One lock per pseudonym: a user's first request waits for its own login, nobody else's
+        self.token_locks = defaultdict(threading.Lock)
+        self.token_locks_lock = threading.Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.results = defaultdict(lambda: {'captured': [], 'replayed': [], 'statuses': defaultdict(int), 'late': 0})
+        self.results_lock = threading.Lock()
+
+    def token_for(self, pseudonym):
+        token = self.tokens.get(pseudonym)
+        if token is not None:
+            return token
+        with self.token_locks_lock:
+            lock = self.token_locks[pseudonym]
+        with lock:
+            if pseudonym not in self.tokens:
+                login = f"replay_{pseudonym}"
+                body = {'login': login, 'password': self.password}
+                response = self.session.post(f"{self.base_url}/api/auth/register", json=body, timeout=self.timeout)
+                if response.status_code != 200:
+                    response = self.session.post(f"{self.base_url}/api/auth/login", json=body, timeout=self.timeout)
+                response.raise_for_status()
+                self.tokens[pseudonym] = response.json()['token']
+            return self.tokens[pseudonym]
+
+    def send(self, record, lateness_ms):
+        path = re.sub(r'\{[^}]+\}', 'replay', record['r'])
+        headers = {}
+        if record['r'].startswith('/api/admin') and self.admin_token:
+            headers['Authorization'] = f"Bearer {self.admin_token}"
+        elif record.get('u'):
+            headers['Authorization'] = f"Bearer {self.token_for(record['u'])}"
+        body = fill_shape(record['b']) if record.get('b') not in (None, 'bytes') else None
+        params = fill_shape(record['q']) if record.get('q') else None
+
+        start = time.perf_counter()
+        try:
+            response = self.session.request(
+                record['m'], f"{self.base_url}{path}",
+                params=params, json=body, headers=headers, timeout=self.timeout
+            )
+            status = response.status_code
+        except requests.RequestException:
+            status = 'error'
+        elapsed_ms = (time.perf_counter() - start) * 1000
+
+        key = f"{record['m']} {record['r']}"
+        with self.results_lock:
+            result = self.results[key]
+            result['captured'].append(record['ms'])
+            result['replayed'].append(elapsed_ms)
+            result['statuses'][status] += 1
+            if lateness_ms > 100:
+                result['late'] += 1
+
+    def run(self, records, speed, concurrency):
+        if not records:
+            return
+        origin = records[0]['t']
+        begin = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for record in records:
+                due = (record['t'] - origin) / speed
+                delay = due - (time.perf_counter() - begin)
+                if delay > 0:
+                    time.sleep(delay)
+                lateness_ms = max(0.0, -delay) * 1000
+                pool.submit(self.send, record, lateness_ms)
+
+    def report(self):
+        rows = []
+        for route, result in sorted(self.results.items()):
+            captured, replayed = result['captured'], result['replayed']
+            rows.append({
+                'route': route,
+                'count': len(replayed),
+                'captured_p50_ms': round(percentile(captured, 0.5), 2),
+                'replayed_p50_ms': round(percentile(replayed, 0.5), 2),
+                'captured_p95_ms': round(percentile(captured, 0.95), 2),
+                'replayed_p95_ms': round(percentile(replayed, 0.95), 2),
+                'delta_p95_ms': round(percentile(replayed, 0.95) - percentile(captured, 0.95), 2),
+                'statuses': {str(status): count for status, count in result['statuses'].items()},
+                'late': result['late'],
+            })
+        return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured traffic against a local instance")
+    parser.add_argument('captures', nargs='+', help="capture files or glob patterns")
+    parser.add_argument('--base-url', default='http://localhost:8001')
+    parser.add_argument('--speed', type=float, default=1.0, help="replay N times faster than captured")
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--password', default='replay-password', help="password for the replay accounts")
+    parser.add_argument('--admin-token', help="token used for /api/admin routes")
+    parser.add_argument('--json', action='store_true', help="print the report as JSON")
+    args = parser.parse_args()
+
+    records = load_capture(args.captures)
+    print(f"Replaying {len(records)} requests at {args.speed:g}x with concurrency {args.concurrency}")
+    replayer = Replayer(args.base_url, args.password, args.admin_token, concurrency=args.concurrency)
+    start = time.perf_counter()
+    replayer.run(records, args.speed, args.concurrency)
+    print(f"Done in {time.perf_counter() - start:.1f}s")
+
+    rows = replayer.report()
+    if args.json:
+        print(json.dumps(rows, indent=2))
+        return
+    print(f"{'route':50} {'count':>6} {'p50 cap':>9} {'p50 rep':>9} {'p95 cap':>9} {'p95 rep':>9} {'Δp95':>9} {'late':>5}  statuses")
+    for row in rows:
+        print(f"{row['route'][:50]:50} {row['count']:>6} {row['captured_p50_ms']:>9} {row['replayed_p50_ms']:>9} "
+              f"{row['captured_p95_ms']:>9} {row['replayed_p95_ms']:>9} {row['delta_p95_ms']:>9} {row['late']:>5}  {row['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
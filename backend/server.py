@@ -1,39 +1,307 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+import time
+_MODULE_T0 = time.perf_counter()
+
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, Request, Query
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.exceptions import HTTPException as StarletteHTTPException
+from starlette.responses import JSONResponse, Response, StreamingResponse
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, InsertOne, UpdateOne, ReadPreference, monitoring
+from pymongo.errors import PyMongoError, DuplicateKeyError, BulkWriteError
 import os
+import asyncio
+import threading
+import sys
+import traceback
+import socket
+import json
+import re
 import logging
+import logging.handlers
+import queue
 from pathlib import Path
+from urllib.parse import parse_qsl, urlencode
 from pydantic import BaseModel, Field, ConfigDict
 from typing import List, Optional
+from collections import OrderedDict, deque
+from bisect import bisect_left, bisect_right, insort
+from decimal import Decimal, ROUND_HALF_UP
 import uuid
+import hashlib
+import heapq
+import math
 from datetime import datetime, timezone, timedelta
 import jwt
 import bcrypt
-import qrcode
 import io
 import base64
 import random
+import gzip
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
 # MongoDB connection
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """Connection pool counters for one client, fed by pymongo's CMAP events."""
+
+    def __init__(self, name: str, max_pool_size: int):
+        self.name = name
+        self.max_pool_size = max_pool_size
+        self._lock = threading.Lock()
+        self.servers = set()
+        self.open = 0
+        self.checked_out = 0
+        self.waiting = 0
+        self.checkout_failures = 0
+        self.pool_clears = 0
+
+    def _add(self, field: str, delta: int):
+        with self._lock:
+            setattr(self, field, getattr(self, field) + delta)
+
+    def pool_created(self, event):
+        self.servers.add(event.address)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add('pool_clears', 1)
+
+    def pool_closed(self, event):
+        self.servers.discard(event.address)
+
+    def connection_created(self, event):
+        self._add('open', 1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add('open', -1)
+
+    def connection_check_out_started(self, event):
+        self._add('waiting', 1)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.waiting -= 1
+            self.checked_out += 1
+
+    def connection_checked_in(self, event):
+        self._add('checked_out', -1)
+
+    def snapshot(self) -> dict:
+        capacity = self.max_pool_size * max(len(self.servers), 1)
+        return {
+            'client': self.name,
+            'servers': len(self.servers),
+            'max_pool_size': self.max_pool_size,
+            'open_connections': self.open,
+            'checked_out': self.checked_out,
+            'waiting': self.waiting,
+            'checkout_failures': self.checkout_failures,
+            'pool_clears': self.pool_clears,
+            'utilization': round(self.checked_out / capacity, 4) if capacity else 0.0
+        }
+
+def mongo_client_options(prefix: str, default_pool_size: int) -> dict:
+    """Build MongoClient kwargs from `<prefix>_*` environment variables."""
+    options = {'maxPoolSize': int(os.environ.get(f'{prefix}_MAX_POOL_SIZE', default_pool_size))}
+    env_options = {
+        'minPoolSize': ('MIN_POOL_SIZE', int),
+        'maxIdleTimeMS': ('MAX_IDLE_TIME_MS', int),
+        'waitQueueTimeoutMS': ('WAIT_QUEUE_TIMEOUT_MS', int),
+        'connectTimeoutMS': ('CONNECT_TIMEOUT_MS', int),
+        'socketTimeoutMS': ('SOCKET_TIMEOUT_MS', int),
+        'serverSelectionTimeoutMS': ('SERVER_SELECTION_TIMEOUT_MS', int),
+        'compressors': ('COMPRESSORS', str),
+        'zlibCompressionLevel': ('ZLIB_COMPRESSION_LEVEL', int),
+    }
+    for option, (suffix, cast) in env_options.items():
+        value = os.environ.get(f'{prefix}_{suffix}', os.environ.get(f'MONGO_{suffix}'))
+        if value:
+            options[option] = cast(value)
+    return options
+
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+_client_options = mongo_client_options('MONGO', 100)
+pool_metrics = PoolMetrics('primary', _client_options['maxPoolSize'])
+client = AsyncIOMotorClient(mongo_url, event_listeners=[pool_metrics], **_client_options)
 db = client[os.environ['DB_NAME']]
 
+# Admin/analytics reads go through their own pool and prefer secondaries,
+# so reporting queries don't queue behind user traffic on the primary
+_analytics_options = mongo_client_options('MONGO_ANALYTICS', 10)
+analytics_pool_metrics = PoolMetrics('analytics', _analytics_options['maxPoolSize'])
+analytics_client = AsyncIOMotorClient(
+    os.environ.get('MONGO_ANALYTICS_URL', mongo_url),
+    event_listeners=[analytics_pool_metrics],
+    read_preference=ReadPreference.SECONDARY_PREFERRED,
+    **_analytics_options
+)
+analytics_db = analytics_client[os.environ['DB_NAME']]
+
 # JWT settings
 JWT_SECRET = os.environ.get('JWT_SECRET', 'faberlic-mining-secret-key-2025')
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24 * 30  # 30 days
+TOKEN_CACHE_SIZE = int(os.environ.get('TOKEN_CACHE_SIZE', '10000'))
+REVOCATION_BLOOM_CAPACITY = int(os.environ.get('REVOCATION_BLOOM_CAPACITY', '100000'))
+REVOCATION_SYNC_OVERLAP = float(os.environ.get('REVOCATION_SYNC_OVERLAP', '30'))
+REVOCATION_RELOAD_INTERVAL = float(os.environ.get('REVOCATION_RELOAD_INTERVAL', '3600'))
 
 # Create the main app
 app = FastAPI()
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
+
+# Startup phases run in registration order; timings are logged on boot
+STARTUP_TARGET_MS = float(os.environ.get('STARTUP_TARGET_MS', '2000'))
+startup_phases = []
+
+def startup_phase(name: str):
+    def register(fn):
+        startup_phases.append((name, fn))
+        return fn
+    return register
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# Migrations
+MIGRATION_HEARTBEAT_SECONDS = float(os.environ.get('MIGRATION_HEARTBEAT_SECONDS', '5'))
+MIGRATION_STALE_SECONDS = float(os.environ.get('MIGRATION_STALE_SECONDS', '30'))
+MIGRATION_POLL_SECONDS = float(os.environ.get('MIGRATION_POLL_SECONDS', '1'))
+
+async def _claim_migration(name: str) -> bool:
+    """Claim `name` if it is new, failed, or its holder stopped heartbeating."""
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=MIGRATION_STALE_SECONDS)
+    try:
+        await db.migrations.update_one(
+            {'_id': name, 'completed_at': {'$exists': False}, '$or': [
+                {'status': 'failed'},
+                {'heartbeat_at': {'$lt': stale}},
+                {'heartbeat_at': {'$exists': False}},
+            ]},
+            {'$set': {'status': 'running', 'holder': WORKER_ID, 'heartbeat_at': now,
+                      'started_at': now.isoformat()},
+             '$unset': {'error': ''}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def run_migration(name: str, migration) -> bool:
+    """Run `migration` once across all workers; True if this worker ran it.
+
+    The claiming worker heartbeats while it runs. A failed or stale claim is
+    taken over by the next worker, so migrations must be safe to re-run.
+    Every other worker waits here until the migration has completed.
+    """
+    while True:
+        state = await db.migrations.find_one({'_id': name})
+        if state and state.get('completed_at'):
+            return False
+        if await _claim_migration(name):
+            break
+        await asyncio.sleep(MIGRATION_POLL_SECONDS)
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(MIGRATION_HEARTBEAT_SECONDS)
+            await db.migrations.update_one(
+                {'_id': name, 'holder': WORKER_ID},
+                {'$set': {'heartbeat_at': datetime.now(timezone.utc)}}
+            )
+
+    beat = asyncio.create_task(heartbeat())
+    try:
+        await migration()
+    except Exception as e:
+        await db.migrations.update_one(
+            {'_id': name, 'holder': WORKER_ID},
+            {'$set': {'status': 'failed', 'error': str(e)}}
+        )
+        raise
+    finally:
+        beat.cancel()
+        await asyncio.gather(beat, return_exceptions=True)
+    await db.migrations.update_one(
+        {'_id': name, 'holder': WORKER_ID},
+        {'$set': {'status': 'completed', 'completed_at': datetime.now(timezone.utc).isoformat()}}
+    )
+    return True
+
+# Background jobs
+background_tasks = []
+
+async def acquire_job_lease(name: str, seconds: float) -> bool:
+    """Take the cluster-wide lease for job `name`; False while anyone, this worker included, holds it."""
+    now = datetime.now(timezone.utc)
+    try:
+        await db.job_leases.update_one(
+            {'_id': name, 'expires_at': {'$lte': now}},
+            {'$set': {'holder': WORKER_ID, 'expires_at': now + timedelta(seconds=seconds)}},
+            upsert=True
+        )
+        return True
+    except DuplicateKeyError:
+        return False
+
+async def release_job_lease(name: str):
+    await db.job_leases.update_one(
+        {'_id': name, 'holder': WORKER_ID},
+        {'$set': {'expires_at': datetime.now(timezone.utc)}}
+    )
+
+def run_periodic(name: str, interval: float, job):
+    """Run `job` every `interval` seconds on whichever worker holds its lease."""
+    async def loop():
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                if await acquire_job_lease(name, interval):
+                    await job()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Background job {name} failed: {str(e)}")
+    background_tasks.append(asyncio.create_task(loop()))
+
+def spawn_background(coro) -> asyncio.Task:
+    """Run `coro` past the current request, cancelled on shutdown like the periodic jobs."""
+    task = asyncio.create_task(coro)
+    background_tasks.append(task)
+    task.add_done_callback(lambda t: t in background_tasks and background_tasks.remove(t))
+    return task
+
+async def stop_background_tasks():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
 
 # Helper functions
 def hash_password(password: str) -> str:
@@ -43,29 +311,84 @@ def verify_password(password: str, hashed: str) -> bool:
     return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
 
 def create_token(user_id: str) -> str:
+    now = datetime.now(timezone.utc)
     payload = {
         'user_id': user_id,
-        'exp': datetime.now(timezone.utc) + timedelta(hours=JWT_EXPIRATION_HOURS)
+        'jti': uuid.uuid4().hex,
+        'iat': int(now.timestamp()),
+        'exp': now + timedelta(hours=JWT_EXPIRATION_HOURS)
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-def verify_token(token: str) -> dict:
+def create_stream_token(user_id: str, scope: str, seconds: int) -> str:
+    """Short-lived token for endpoints a browser opens without headers (EventSource)."""
+    now = datetime.now(timezone.utc)
+    payload = {
+        'user_id': user_id,
+        'scope': scope,
+        'iat': int(now.timestamp()),
+        'exp': now + timedelta(seconds=seconds)
+    }
+    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
+
+def verify_stream_token(token: str, scope: str) -> dict:
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+    except jwt.ExpiredSignatureError:
+        raise HTTPException(status_code=401, detail="Token expired")
+    except jwt.InvalidTokenError:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get('scope') != scope:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return payload
+
+# Verified token -> payload, bounded LRU
+_token_cache = OrderedDict()
+
+def verify_token(token: str) -> dict:
+    payload = _token_cache.get(token)
+    if payload is not None:
+        if payload['exp'] <= time.time():
+            _token_cache.pop(token, None)
+            raise HTTPException(status_code=401, detail="Token expired")
+        _token_cache.move_to_end(token)
         return payload
+    try:
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
+    if payload.get('scope'):
+        # Scoped stream tokens only open their own stream
+        raise HTTPException(status_code=401, detail="Invalid token")
+    _token_cache[token] = payload
+    if len(_token_cache) > TOKEN_CACHE_SIZE:
+        _token_cache.popitem(last=False)
+    return payload
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def get_token_payload(request: Request, credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """Authenticate without loading the user document."""
+    batch = request.scope.get('batch')
+    if batch:
+        # Sub-request of /api/batch: the outer request already authenticated
+        return batch['payload']
     payload = verify_token(credentials.credentials)
+    if await revocation_list.is_revoked(payload):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    return payload
+
+async def get_current_user(request: Request, payload: dict = Depends(get_token_payload)):
+    batch = request.scope.get('batch')
+    if batch:
+        return dict(batch['user'])
     user = await db.users.find_one({'id': payload['user_id']}, {'_id': 0})
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 def generate_qr_code(data: str) -> str:
+    import qrcode  # pulls in PIL; only workers that render QR codes pay for it
     qr = qrcode.QRCode(version=1, box_size=10, border=5)
     qr.add_data(data)
     qr.make(fit=True)
@@ -75,6 +398,544 @@ def generate_qr_code(data: str) -> str:
     buffer.seek(0)
     return base64.b64encode(buffer.getvalue()).decode()
 
+# Money: ledger amounts (users, transactions, orders, farms) are stored as
+# integer cents so $inc and $sum are exact; the API still speaks USDT.
+# Catalog settings (VIP levels, animals, campaigns) stay in USDT.
+MONEY_FIELDS = {
+    'users': ('balance', 'daily_earnings', 'total_earnings', 'deposit_amount'),
+    'transactions': ('amount',),
+    'orders': ('product_price', 'cashback'),
+    'order_offers': ('product_price', 'cashback'),
+    'user_farms': ('total_collected', 'purchase_price'),
+}
+
+def to_cents(amount) -> int:
+    return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+
+def from_cents(cents: int) -> float:
+    return round(cents / 100, 2)
+
+def public_money(doc: dict, collection: str) -> dict:
+    doc = dict(doc)
+    doc.pop('money_unit', None)
+    for field in MONEY_FIELDS[collection]:
+        if doc.get(field) is not None:
+            doc[field] = from_cents(doc[field])
+    return doc
+
+def public_user(user: dict) -> dict:
+    user = public_money(user, 'users')
+    user.pop('password', None)
+    user.pop('credited_batches', None)
+    return user
+
+async def inc_user_money(user_id: str, inc: dict, guard: Optional[dict] = None,
+                         set_fields: Optional[dict] = None) -> Optional[dict]:
+    """Blindly `$inc` cent amounts on a user and return the updated document.
+
+    `guard` adds conditions (e.g. sufficient balance); None means it didn't match.
+    `set_fields` are `$set` in the same atomic update (e.g. embedded game state).
+    """
+    update = {'$inc': inc}
+    if set_fields:
+        update['$set'] = set_fields
+    return await db.users.find_one_and_update(
+        {'id': user_id, **(guard or {})},
+        update,
+        projection={'_id': 0, 'password': 0},
+        return_document=ReturnDocument.AFTER
+    )
+
+# Cache invalidation bus
+CACHE_POLL_INTERVAL = float(os.environ.get('CACHE_POLL_INTERVAL', '2'))
+CACHE_MAX_AGE = float(os.environ.get('CACHE_MAX_AGE', '300'))
+
+class CacheBus:
+    """Cross-worker invalidation through version counters in `cache_versions`.
+
+    Every worker remembers the last version it saw for each cache name. A bump
+    from any worker reaches the others through a change stream when the
+    deployment supports one (replica set), otherwise through polling the
+    collection, which only holds one tiny document per cache.
+    """
+
+    def __init__(self, collection, poll_interval: float):
+        self.collection = collection
+        self.poll_interval = poll_interval
+        self.versions = {}
+        self.subscribers = {}
+        self._task = None
+
+    def subscribe(self, name: str, callback):
+        self.subscribers.setdefault(name, []).append(callback)
+
+    def version(self, name: str) -> int:
+        return self.versions.get(name, 0)
+
+    def _apply(self, name: str, version: int):
+        if self.versions.get(name) == version:
+            return
+        self.versions[name] = version
+        for callback in self.subscribers.get(name, []):
+            callback()
+
+    async def bump(self, name: str) -> int:
+        doc = await self.collection.find_one_and_update(
+            {'_id': name},
+            {'$inc': {'version': 1}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        self._apply(name, doc['version'])
+        return doc['version']
+
+    async def refresh(self):
+        async for doc in self.collection.find({}):
+            self._apply(doc['_id'], doc['version'])
+
+    async def _watch(self):
+        async with self.collection.watch(full_document='updateLookup') as stream:
+            # Refresh only once the stream is open, so a bump in between is
+            # either in the refresh or delivered by the stream
+            await self.refresh()
+            async for change in stream:
+                doc = change.get('fullDocument')
+                if doc:
+                    self._apply(doc['_id'], doc['version'])
+
+    async def _run(self):
+        try:
+            await self._watch()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.info(f"Cache bus change stream unavailable ({e}), polling every {self.poll_interval}s")
+        while True:
+            try:
+                await self.refresh()
+            except PyMongoError as e:
+                logging.error(f"Cache bus poll error: {str(e)}")
+            await asyncio.sleep(self.poll_interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+class ProcessCache:
+    """Process-local key/value cache dropped whenever its bus version changes.
+
+    `max_age` is a safety net for a worker that loses contact with the bus.
+    """
+
+    def __init__(self, bus: CacheBus, name: str, max_age: float = CACHE_MAX_AGE):
+        self.bus = bus
+        self.name = name
+        self.max_age = max_age
+        self._data = {}
+        bus.subscribe(name, self.clear)
+
+    def clear(self):
+        self._data.clear()
+
+    async def get_or_load(self, key, loader):
+        entry = self._data.get(key)
+        if entry and time.monotonic() - entry[0] < self.max_age:
+            return entry[1]
+        version = self.bus.version(self.name)
+        value = await loader()
+        # Don't store a value that was loaded across an invalidation
+        if self.bus.version(self.name) == version:
+            self._data[key] = (time.monotonic(), value)
+        return value
+
+    async def invalidate(self):
+        await self.bus.bump(self.name)
+
+cache_bus = CacheBus(db.cache_versions, CACHE_POLL_INTERVAL)
+vip_levels_cache = ProcessCache(cache_bus, 'vip_levels')
+farm_animals_cache = ProcessCache(cache_bus, 'farm_animals')
+notifications_cache = ProcessCache(cache_bus, 'notifications')
+
+# HTTP caching for catalog endpoints: strong ETags from the bus version
+def catalog_etag(name: str) -> str:
+    return f'"{name}-{cache_bus.version(name)}"'
+
+def conditional_response(request: Request, response: Response, name: str, cache_control: str,
+                         variant: str = '') -> Optional[Response]:
+    """Return a 304 if the client already has the current version of `name`,
+    otherwise stamp ETag/Cache-Control on `response` and return None.
+
+    `variant` distinguishes per-user or per-query views of the same data.
+    """
+    etag = catalog_etag(name)
+    if variant:
+        etag = f'{etag[:-1]}-{variant}"'
+    # CompressionMiddleware may encode the body, so caches must key on Accept-Encoding
+    headers = {'ETag': etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        # Weak comparison: compressed responses carry the weakened W/ form
+        tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+        if '*' in tags or etag in tags:
+            return Response(status_code=304, headers=headers)
+    response.headers.update(headers)
+    return None
+
+# Write-behind queue for non-critical writes (audit rows, last_login)
+WRITE_BEHIND_INTERVAL = float(os.environ.get('WRITE_BEHIND_INTERVAL', '0.5'))
+WRITE_BEHIND_BATCH_SIZE = int(os.environ.get('WRITE_BEHIND_BATCH_SIZE', '500'))
+WRITE_BEHIND_MAX_SIZE = int(os.environ.get('WRITE_BEHIND_MAX_SIZE', '10000'))
+
+class WriteBehindQueue:
+    """Buffers write models per collection and flushes them with `bulk_write`.
+
+    Flushes run every `interval` seconds or as soon as `batch_size` writes are
+    waiting. A full queue makes the caller flush inline, so memory stays
+    bounded. Until `start()` (and after `stop()`) writes go straight through.
+    """
+
+    def __init__(self, database, interval: float, batch_size: int, max_size: int):
+        self.database = database
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_size = max_size
+        self.pending = []
+        self.flushed = 0
+        self.failed = 0
+        self._wake = asyncio.Event()
+        self._lock = asyncio.Lock()
+        self._task = None
+
+    @property
+    def depth(self) -> int:
+        return len(self.pending)
+
+    async def put(self, collection: str, op):
+        if self._task is None:
+            await self.database[collection].bulk_write([op])
+            return
+        self.pending.append((collection, op))
+        if len(self.pending) >= self.max_size:
+            await self.flush()
+        elif len(self.pending) >= self.batch_size:
+            self._wake.set()
+
+    async def insert(self, collection: str, doc: dict):
+        await self.put(collection, InsertOne(doc))
+
+    async def update(self, collection: str, query: dict, update: dict, upsert: bool = False):
+        await self.put(collection, UpdateOne(query, update, upsert=upsert))
+
+    async def flush(self):
+        async with self._lock:
+            batch, self.pending = self.pending, []
+            if not batch:
+                return
+            by_collection = {}
+            for collection, op in batch:
+                by_collection.setdefault(collection, []).append(op)
+            for collection, ops in by_collection.items():
+                try:
+                    await self.database[collection].bulk_write(ops, ordered=False)
+                    self.flushed += len(ops)
+                except BulkWriteError as e:
+                    # Duplicate keys mean an earlier retried flush already landed
+                    errors = [err for err in e.details.get('writeErrors', []) if err.get('code') != 11000]
+                    self.flushed += len(ops) - len(errors)
+                    if errors:
+                        self.failed += len(errors)
+                        logging.error(f"Write-behind flush to {collection} dropped {len(errors)} writes: {errors[0].get('errmsg')}")
+                except PyMongoError as e:
+                    logging.error(f"Write-behind flush to {collection} failed, requeueing {len(ops)} writes: {str(e)}")
+                    room = max(0, self.max_size - len(self.pending))
+                    self.failed += max(0, len(ops) - room)
+                    self.pending[:0] = [(collection, op) for op in ops[:room]]
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and drain whatever is still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+write_behind = WriteBehindQueue(db, WRITE_BEHIND_INTERVAL, WRITE_BEHIND_BATCH_SIZE, WRITE_BEHIND_MAX_SIZE)
+
+# Event loop monitoring
+LOOP_LAG_INTERVAL = float(os.environ.get('LOOP_LAG_INTERVAL', '0.5'))
+LOOP_BLOCK_THRESHOLD_MS = float(os.environ.get('LOOP_BLOCK_THRESHOLD_MS', '0'))  # 0 disables the watchdog
+LOOP_BLOCK_REPORTS = int(os.environ.get('LOOP_BLOCK_REPORTS', '50'))
+
+class LoopMonitor:
+    """Samples event-loop lag and, when a threshold is set, watches for blocking calls.
+
+    A heartbeat task sleeps `interval` seconds and measures how late it wakes up.
+    The watchdog is a plain thread: if the heartbeat is overdue by more than
+    `threshold_ms` it grabs the loop thread's current stack, which is whatever
+    synchronous code is holding the loop, plus the request it belongs to.
+    """
+
+    def __init__(self, interval: float, threshold_ms: float, max_reports: int):
+        self.threshold_ms = threshold_ms
+        self.interval = min(interval, threshold_ms / 2000) if threshold_ms > 0 else interval
+        self.lag_ms = 0.0
+        self.max_lag_ms = 0.0
+        self.reports = deque(maxlen=max_reports)
+        self._beat = time.monotonic()
+        self._reported_beat = None
+        self._loop_thread = None
+        self._task = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    async def _sample(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.lag_ms = max(0.0, (now - start - self.interval) * 1000)
+            self.max_lag_ms = max(self.max_lag_ms, self.lag_ms)
+            if self._reported_beat == self._beat and self.reports:
+                # The stall we reported is over; record how long it really was
+                self.reports[-1]['blocked_ms'] = round(self.lag_ms, 1)
+            self._beat = now
+
+    @staticmethod
+    def _route(frame) -> Optional[str]:
+        while frame is not None:
+            scope = frame.f_locals.get('scope')
+            if isinstance(scope, dict) and scope.get('type') == 'http':
+                return f"{scope.get('method')} {scope.get('path')}"
+            frame = frame.f_back
+        return None
+
+    def _capture(self, beat: float, overdue_ms: float):
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        report = {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'blocked_ms': round(overdue_ms, 1),
+            'route': self._route(frame),
+            'stack': traceback.format_stack(frame),
+        }
+        self._reported_beat = beat
+        self.reports.append(report)
+        logging.warning(
+            f"Event loop blocked for {overdue_ms:.0f}ms+ in {report['route'] or 'background task'}:\n"
+            + ''.join(report['stack'][-8:])
+        )
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold_ms / 2000):
+            beat = self._beat
+            overdue_ms = (time.monotonic() - beat - self.interval) * 1000
+            if overdue_ms > self.threshold_ms and self._reported_beat != beat:
+                self._capture(beat, overdue_ms)
+
+    def start(self):
+        if self._task is None:
+            self._loop_thread = threading.get_ident()
+            self._beat = time.monotonic()
+            self._task = asyncio.create_task(self._sample())
+        if self.threshold_ms > 0 and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+            self._thread.start()
+
+    async def stop(self):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+loop_monitor = LoopMonitor(LOOP_LAG_INTERVAL, LOOP_BLOCK_THRESHOLD_MS, LOOP_BLOCK_REPORTS)
+
+# Token revocation
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float = 0.01):
+        capacity = max(capacity, 1)
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: str):
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key: str) -> bool:
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+class RevocationList:
+    """Revoked token ids and per-user revocations, mirrored into an in-memory bloom filter.
+
+    Entries live in `revoked_tokens` (TTL-expired with the tokens they cover).
+    A bloom miss, the common case, answers without I/O; a hit is confirmed
+    against Mongo so false positives never log anyone out. When the
+    `revoked_tokens` bus version changes, other workers add the entries written
+    since their last sync; the whole filter is only rebuilt at startup and
+    every `reload_interval` seconds, to drop expired entries.
+    """
+
+    def __init__(self, bus: CacheBus, collection, capacity: int,
+                 sync_overlap: float, reload_interval: float):
+        self.collection = collection
+        self.capacity = capacity
+        self.sync_overlap = timedelta(seconds=sync_overlap)
+        self.reload_interval = reload_interval
+        self.bloom = BloomFilter(capacity)
+        self.synced_at = None
+        self._loaded_at = 0.0
+        self._reloading = None
+        self._dirty = False
+        self._sync_task = None
+        self.bus = bus
+        bus.subscribe('revoked_tokens', self._schedule_sync)
+
+    def _schedule_sync(self):
+        # A bump during a running sync marks it dirty, so that sync goes round again
+        self._dirty = True
+        if self._sync_task is None or self._sync_task.done():
+            self._sync_task = asyncio.create_task(self._sync_until_clean())
+
+    async def _sync_until_clean(self):
+        while self._dirty:
+            self._dirty = False
+            try:
+                await self.sync()
+            except PyMongoError as e:
+                logging.error(f"Revocation list sync failed: {str(e)}")
+                return
+
+    def _mirror(self, key: str):
+        self.bloom.add(key)
+        if self._reloading is not None:
+            self._reloading.add(key)
+
+    async def reload(self):
+        started = datetime.now(timezone.utc)
+        self._reloading = set()
+        try:
+            keys = await self.collection.distinct('key')
+            bloom = BloomFilter(max(self.capacity, len(keys) * 2))
+            for key in keys:
+                bloom.add(key)
+            # Keys revoked locally while distinct() ran may be missing from its snapshot
+            for key in self._reloading:
+                bloom.add(key)
+            self.bloom = bloom
+        finally:
+            self._reloading = None
+        self.synced_at = started
+        self._loaded_at = time.monotonic()
+
+    async def sync(self):
+        """Add entries written since the last sync; the overlap covers in-flight writes."""
+        if self.synced_at is None or time.monotonic() - self._loaded_at > self.reload_interval:
+            await self.reload()
+            return
+        started = datetime.now(timezone.utc)
+        async for entry in self.collection.find(
+            {'added_at': {'$gte': self.synced_at - self.sync_overlap}}, {'_id': 0, 'key': 1}
+        ):
+            self._mirror(entry['key'])
+        self.synced_at = started
+
+    async def is_revoked(self, payload: dict) -> bool:
+        jti = payload.get('jti')
+        if jti and jti in self.bloom:
+            if await self.collection.find_one({'key': jti}, {'_id': 1}):
+                return True
+        if not jti and 'iat' not in payload:
+            # Issued before tokens carried a jti; those can only be revoked per user
+            legacy_key = f"legacy:{payload['user_id']}"
+            if legacy_key in self.bloom and await self.collection.find_one({'key': legacy_key}, {'_id': 1}):
+                return True
+        user_key = f"user:{payload['user_id']}"
+        if user_key in self.bloom:
+            entry = await self.collection.find_one({'key': user_key}, {'_id': 0, 'revoked_at': 1})
+            if entry and payload.get('iat', 0) <= entry['revoked_at']:
+                return True
+        return False
+
+    async def _add(self, key: str, doc: dict):
+        await self.collection.update_one(
+            {'key': key},
+            {'$set': {**doc, 'added_at': datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        self._mirror(key)
+        await self.bus.bump('revoked_tokens')
+
+    async def revoke_token(self, payload: dict):
+        await self._add(payload['jti'], {
+            'expires_at': datetime.fromtimestamp(payload['exp'], timezone.utc)
+        })
+
+    async def revoke_legacy_tokens(self, user_id: str):
+        """Revoke the user's tokens without jti/iat; no such tokens are issued any more."""
+        now = datetime.now(timezone.utc)
+        await self._add(f"legacy:{user_id}", {
+            'expires_at': now + timedelta(hours=JWT_EXPIRATION_HOURS)
+        })
+
+    async def revoke_user(self, user_id: str):
+        now = datetime.now(timezone.utc)
+        await self._add(f"user:{user_id}", {
+            'revoked_at': int(now.timestamp()),
+            'expires_at': now + timedelta(hours=JWT_EXPIRATION_HOURS)
+        })
+
+revocation_list = RevocationList(
+    cache_bus, db.revoked_tokens, REVOCATION_BLOOM_CAPACITY,
+    REVOCATION_SYNC_OVERLAP, REVOCATION_RELOAD_INTERVAL
+)
+
+@startup_phase('revocation_list')
+async def load_revocation_list():
+    await db.revoked_tokens.create_index('key', unique=True)
+    await db.revoked_tokens.create_index('expires_at', expireAfterSeconds=0)
+    await db.revoked_tokens.create_index('added_at')
+    await revocation_list.reload()
+
 # Models
 class RegisterRequest(BaseModel):
     login: str
@@ -84,18 +945,44 @@ class LoginRequest(BaseModel):
     login: str
     password: str
 
+class MiningState(BaseModel):
+    tap_count: int = 0
+    last_tap_time: Optional[str] = None
+    daily_taps: int = 0
+    last_reset: Optional[str] = None
+
+class SpinState(BaseModel):
+    last_spin_date: str = ''
+    total_spins: int = 0
+
+class DailyResetState(BaseModel):
+    date: str = ''
+
+class NotificationState(BaseModel):
+    # Notification counters as of the last "mark seen"; unread = current - seen
+    last_seen_seq: int = 0
+    global_seen: int = 0
+    segments_seen: dict = {}
+    direct: int = 0
+    direct_seen: int = 0
+
 class User(BaseModel):
     id: str
     login: str
     role: str = "user"  # user or admin
-    balance: float = 0.0
-    daily_earnings: float = 0.0
-    total_earnings: float = 0.0
+    balance: int = 0  # money fields are integer cents
+    daily_earnings: int = 0
+    total_earnings: int = 0
     vip_level: int = 0
-    deposit_amount: float = 0.0
+    deposit_amount: int = 0
     wallet_address: Optional[str] = None
     created_at: str
     last_login: str
+    # Per-user game state lives on the user document so each action is one atomic update
+    mining: MiningState = MiningState()
+    spin: SpinState = SpinState()
+    daily_reset: DailyResetState = DailyResetState()
+    notification_state: NotificationState = NotificationState()
 
 class VIPLevel(BaseModel):
     level: int
@@ -111,8 +998,8 @@ class Order(BaseModel):
     user_id: str
     product_name: str
     product_code: str
-    product_price: float
-    cashback: float
+    product_price: int  # cents
+    cashback: int  # cents
     qr_code: str
     status: str  # pending, completed, rejected
     created_at: str
@@ -121,8 +1008,8 @@ class Order(BaseModel):
 class Transaction(BaseModel):
     id: str
     user_id: str
-    type: str  # deposit, withdraw, order, mining, spin, task
-    amount: float
+    type: str  # deposit, withdraw, order, mining, spin, task, bonus
+    amount: int  # cents
     status: str  # pending, completed, rejected
     wallet_address: Optional[str] = None
     created_at: str
@@ -135,13 +1022,19 @@ class MiningStatus(BaseModel):
     last_tap_time: Optional[str] = None
     daily_taps: int
     last_reset: str
+    mining_tap_limit: int
+    mining_window_hours: float
+    mining_reward: float
 
 class Notification(BaseModel):
     id: str
+    seq: int  # monotonic, for incremental fetches
     title: str
     message: str
     created_at: str
     is_global: bool = True
+    user_ids: Optional[List[str]] = None  # direct notification
+    vip_levels: Optional[List[int]] = None  # segment notification
 
 class SpinHistory(BaseModel):
     user_id: str
@@ -168,13 +1061,27 @@ class FarmAnimal(BaseModel):
     collect_hours: int
     is_active: bool
 
+class SpinReward(BaseModel):
+    amount: float = Field(ge=0)
+    weight: float = Field(gt=0)
+
+class RewardConfigUpdate(BaseModel):
+    spin_rewards: Optional[List[SpinReward]] = None
+    mining_reward: Optional[float] = Field(default=None, ge=0)
+    mining_tap_limit: Optional[int] = Field(default=None, ge=0)
+    mining_window_hours: Optional[float] = Field(default=None, gt=0)
+
+class BulkTransactionRequest(BaseModel):
+    ids: List[str]
+    note: str = ""
+
 class UserFarm(BaseModel):
     id: str
     user_id: str
     animal_id: str
     purchased_at: str
     last_collect: Optional[str]
-    total_collected: float
+    total_collected: int  # cents
 
 # Auth endpoints
 @api_router.post("/auth/register")
@@ -193,55 +1100,28 @@ async def register(req: RegisterRequest):
             'login': req.login,
             'password': hash_password(req.password),
             'role': 'user',
-            'balance': 0.0,
-            'daily_earnings': 0.0,
-            'total_earnings': 0.0,
+            'balance': 0,
+            'daily_earnings': 0,
+            'total_earnings': 0,
             'vip_level': 0,
-            'deposit_amount': 0.0,
+            'deposit_amount': 0,
             'wallet_address': None,
             'created_at': now,
-            'last_login': now
+            'last_login': now,
+            'mining': MiningState(last_reset=now).model_dump(),
+            'spin': SpinState().model_dump(),
+            'daily_reset': DailyResetState().model_dump(),
+            # Start from the current counters: a new account has nothing unread
+            'notification_state': await initial_notification_state()
         }
         
         # Insert and get clean data
         result = await db.users.insert_one(user_data.copy())
         
-        # Initialize mining status
-        mining_data = {
-            'user_id': user_id,
-            'tap_count': 0,
-            'last_tap_time': None,
-            'daily_taps': 0,
-            'last_reset': now
-        }
-        await db.mining.insert_one(mining_data)
-        
-        # Initialize spin history
-        spin_data = {
-            'user_id': user_id,
-            'last_spin_date': '',
-            'total_spins': 0
-        }
-        await db.spins.insert_one(spin_data)
-        
         token = create_token(user_id)
         
         # Return clean data without password
-        response_user = {
-            'id': user_data['id'],
-            'login': user_data['login'],
-            'role': user_data['role'],
-            'balance': user_data['balance'],
-            'daily_earnings': user_data['daily_earnings'],
-            'total_earnings': user_data['total_earnings'],
-            'vip_level': user_data['vip_level'],
-            'deposit_amount': user_data['deposit_amount'],
-            'wallet_address': user_data['wallet_address'],
-            'created_at': user_data['created_at'],
-            'last_login': user_data['last_login']
-        }
-        
-        return {'token': token, 'user': response_user}
+        return {'token': token, 'user': public_user(user_data)}
     except HTTPException:
         raise
     except Exception as e:
@@ -257,175 +1137,343 @@ async def login(req: LoginRequest):
     if not verify_password(req.password, user['password']):
         raise HTTPException(status_code=401, detail="Login və ya parol səhvdir")
     
+    if user.get('is_banned'):
+        raise HTTPException(status_code=403, detail="Hesab bloklanıb")
+    
     # Update last login
-    await db.users.update_one(
+    await write_behind.update(
+        'users',
         {'id': user['id']},
         {'$set': {'last_login': datetime.now(timezone.utc).isoformat()}}
     )
     
     token = create_token(user['id'])
-    user.pop('password')
     
-    return {'token': token, 'user': user}
+    return {'token': token, 'user': public_user(user)}
+
+@api_router.post("/auth/logout")
+async def logout(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    payload = verify_token(credentials.credentials)
+    if payload.get('jti'):
+        await revocation_list.revoke_token(payload)
+    else:
+        await revocation_list.revoke_legacy_tokens(payload['user_id'])
+    _token_cache.pop(credentials.credentials, None)
+    return {'success': True}
 
 @api_router.get("/auth/me")
 async def get_me(current_user: dict = Depends(get_current_user)):
-    return current_user
+    return public_user(current_user)
 
 # VIP endpoints
+DEFAULT_VIP_LEVELS = [
+    {'level': 1, 'name': 'VIP 1', 'deposit_required': 1000, 'max_daily_earnings': 50, 'orders_per_day': 10, 'commission_per_order': 5, 'is_active': True},
+    {'level': 2, 'name': 'VIP 2', 'deposit_required': 3000, 'max_daily_earnings': 150, 'orders_per_day': 30, 'commission_per_order': 5, 'is_active': True},
+    {'level': 3, 'name': 'VIP 3', 'deposit_required': 8000, 'max_daily_earnings': 500, 'orders_per_day': 100, 'commission_per_order': 5, 'is_active': True},
+    {'level': 4, 'name': 'VIP 4', 'deposit_required': 15000, 'max_daily_earnings': 800, 'orders_per_day': 160, 'commission_per_order': 5, 'is_active': True},
+    {'level': 5, 'name': 'VIP 5', 'deposit_required': 30000, 'max_daily_earnings': 1500, 'orders_per_day': 300, 'commission_per_order': 5, 'is_active': True},
+]
+
+@startup_phase('seed_vip_levels')
+async def seed_vip_levels():
+    async def seed():
+        if await db.vip_levels.count_documents({}) == 0:
+            await db.vip_levels.insert_many([dict(level) for level in DEFAULT_VIP_LEVELS])
+            await vip_levels_cache.invalidate()
+    await run_migration('seed_vip_levels', seed)
+    await db.vip_levels.create_index('level')
+
+async def _fetch_vip_levels():
+    return await db.vip_levels.find({}, {'_id': 0}).sort('level', 1).to_list(100)
+
+async def get_cached_vip_levels() -> List[dict]:
+    return await vip_levels_cache.get_or_load('all', _fetch_vip_levels)
+
+async def get_vip_level(level: int) -> Optional[dict]:
+    levels = await get_cached_vip_levels()
+    return next((l for l in levels if l['level'] == level), None)
+
+VIP_RETIER_DOWNGRADE = os.environ.get('VIP_RETIER_DOWNGRADE', 'false').lower() == 'true'
+
+def vip_tiers(levels: List[dict]) -> List[tuple]:
+    """(threshold_cents, level) steps, ascending: a deposit of at least the
+    threshold earns the highest active level whose requirement it meets."""
+    tiers = []
+    best = 0
+    for level in sorted((l for l in levels if l.get('is_active')), key=lambda l: (to_cents(l['deposit_required']), l['level'])):
+        threshold = to_cents(level['deposit_required'])
+        best = max(best, level['level'])
+        if tiers and tiers[-1][0] == threshold:
+            tiers[-1] = (threshold, best)
+        elif not tiers or tiers[-1][1] != best:
+            tiers.append((threshold, best))
+    return tiers
+
+def vip_level_for_deposit(tiers: List[tuple], deposit: int) -> int:
+    i = bisect_right([threshold for threshold, _ in tiers], deposit)
+    return tiers[i - 1][1] if i else 0
+
+def vip_level_expression(tiers: List[tuple]) -> dict:
+    """Aggregation expression computing the tier of the (already updated) `$deposit_amount`."""
+    return {'$switch': {
+        'branches': [
+            {'case': {'$gte': ['$deposit_amount', threshold]}, 'then': level}
+            for threshold, level in reversed(tiers)
+        ],
+        'default': 0
+    }}
+
+async def retier_all_users(allow_downgrade: bool = VIP_RETIER_DOWNGRADE) -> dict:
+    """Recompute every user's VIP level with one range `update_many` per tier."""
+    # Read the levels directly: this worker's cache may not have seen the edit yet
+    tiers = vip_tiers(await _fetch_vip_levels())
+    bounds = [(0, 0)] + tiers
+    changed = {}
+    for i, (threshold, level) in enumerate(bounds):
+        deposit_range = {'$gte': threshold}
+        if i + 1 < len(bounds):
+            deposit_range['$lt'] = bounds[i + 1][0]
+        level_filter = {'$ne': level} if allow_downgrade else {'$lt': level}
+        result = await db.users.update_many(
+            {'deposit_amount': deposit_range, 'vip_level': level_filter},
+            {'$set': {'vip_level': level}}
+        )
+        changed[level] = result.modified_count
+    total = sum(changed.values())
+    if total:
+        await cache_bus.bump('vip_assignments')
+    return {'changed': changed, 'total': total}
+
+async def _finish_retier() -> bool:
+    """Release the re-tier lease unless a rerun was requested while it ran.
+
+    False means the flag was set (and is now cleared): the holder runs again.
+    """
+    released = await db.job_leases.update_one(
+        {'_id': 'retier_users', 'holder': WORKER_ID, 'rerun_requested': {'$ne': True}},
+        {'$set': {'expires_at': datetime.now(timezone.utc)}}
+    )
+    if released.matched_count:
+        return True
+    rerun = await db.job_leases.update_one(
+        {'_id': 'retier_users', 'holder': WORKER_ID},
+        {'$set': {'rerun_requested': False}}
+    )
+    return rerun.matched_count == 0
+
+async def _retier_until_settled(allow_downgrade: bool = VIP_RETIER_DOWNGRADE):
+    """Re-tier with the lease held, going round again while reruns are requested."""
+    while True:
+        try:
+            result = await retier_all_users(allow_downgrade)
+            logging.info(f"VIP re-tier after level edit: {result}")
+        except Exception as e:
+            logging.error(f"VIP re-tier failed: {str(e)}")
+            await release_job_lease('retier_users')
+            return
+        if await _finish_retier():
+            return
+
+async def _retier_in_background():
+    while not await acquire_job_lease('retier_users', 600):
+        # Someone is re-tiering with levels that may predate this edit; ask them to go again
+        requested = await db.job_leases.update_one(
+            {'_id': 'retier_users', 'expires_at': {'$gt': datetime.now(timezone.utc)}},
+            {'$set': {'rerun_requested': True}}
+        )
+        if requested.matched_count:
+            return
+    await _retier_until_settled()
+
+@startup_phase('vip_indexes')
+async def ensure_vip_indexes():
+    await db.users.create_index('deposit_amount')
+
 @api_router.get("/vip/levels")
-async def get_vip_levels():
-    levels = await db.vip_levels.find({}, {'_id': 0}).to_list(100)
-    if not levels:
-        # Initialize default VIP levels
-        default_levels = [
-            {'level': 1, 'name': 'VIP 1', 'deposit_required': 1000, 'max_daily_earnings': 50, 'orders_per_day': 10, 'commission_per_order': 5, 'is_active': True},
-            {'level': 2, 'name': 'VIP 2', 'deposit_required': 3000, 'max_daily_earnings': 150, 'orders_per_day': 30, 'commission_per_order': 5, 'is_active': True},
-            {'level': 3, 'name': 'VIP 3', 'deposit_required': 8000, 'max_daily_earnings': 500, 'orders_per_day': 100, 'commission_per_order': 5, 'is_active': True},
-            {'level': 4, 'name': 'VIP 4', 'deposit_required': 15000, 'max_daily_earnings': 800, 'orders_per_day': 160, 'commission_per_order': 5, 'is_active': True},
-            {'level': 5, 'name': 'VIP 5', 'deposit_required': 30000, 'max_daily_earnings': 1500, 'orders_per_day': 300, 'commission_per_order': 5, 'is_active': True},
-        ]
-        await db.vip_levels.insert_many(default_levels)
-        levels = default_levels
-    return levels
+async def get_vip_levels(request: Request, response: Response):
+    not_modified = conditional_response(request, response, 'vip_levels', 'public, max-age=60')
+    if not_modified:
+        return not_modified
+    return await get_cached_vip_levels()
 
 @api_router.post("/vip/upgrade")
 async def upgrade_vip(current_user: dict = Depends(get_current_user)):
-    levels = await db.vip_levels.find({}, {'_id': 0}).sort('level', 1).to_list(100)
+    levels = await get_cached_vip_levels()
     
     current_level = current_user['vip_level']
     deposit = current_user['deposit_amount']
     
     # Find highest level user qualifies for
-    new_level = 0
-    for level in levels:
-        if deposit >= level['deposit_required'] and level['is_active']:
-            new_level = level['level']
+    new_level = vip_level_for_deposit(vip_tiers(levels), deposit)
     
     if new_level > current_level:
         await db.users.update_one(
             {'id': current_user['id']},
             {'$set': {'vip_level': new_level}}
         )
+        await cache_bus.bump('vip_assignments')
         return {'success': True, 'new_level': new_level}
     
     return {'success': False, 'message': 'Kifayət qədər depozit yoxdur'}
 
 # Order endpoints
+# Offers are generated once per user per slot and kept in `order_offers`
+# until accepted, rejected or expired (TTL index on expires_at).
+ORDER_OFFER_TTL_MINUTES = int(os.environ.get('ORDER_OFFER_TTL_MINUTES', '30'))
+ORDER_SLOT_SECONDS = int(os.environ.get('ORDER_SLOT_SECONDS', '60'))
+ORDER_PRODUCTS = [
+    {'name': 'Faberlic Expert Pharma Krem', 'base_price': 45.99, 'category': 'Kosmetika'},
+    {'name': 'Oriflame The ONE Ruj', 'base_price': 18.50, 'category': 'Makeup'},
+    {'name': 'Faberlic Oxygen Serum', 'base_price': 67.00, 'category': 'Dəri Baxımı'},
+    {'name': 'Oriflame Eclat Parfüm', 'base_price': 89.99, 'category': 'Parfüm'},
+    {'name': 'Faberlic Fitness Body Krem', 'base_price': 32.50, 'category': 'Bədən Baxımı'},
+    {'name': 'Oriflame Giordani Gold Parfüm', 'base_price': 125.00, 'category': 'Parfüm'},
+    {'name': 'Faberlic Expert Pharma Şampun', 'base_price': 28.75, 'category': 'Saç Baxımı'},
+    {'name': 'Oriflame NovAge Serum', 'base_price': 95.50, 'category': 'Dəri Baxımı'},
+    {'name': 'Faberlic Home Aromatherapy', 'base_price': 41.25, 'category': 'Ev üçün'},
+    {'name': 'Oriflame The ONE İllumina', 'base_price': 22.99, 'category': 'Makeup'},
+]
+
+@startup_phase('order_offer_indexes')
+async def ensure_order_offer_indexes():
+    await db.order_offers.create_index('expires_at', expireAfterSeconds=0)
+    await db.order_offers.create_index('id')
+    await db.order_offers.create_index([('user_id', 1), ('status', 1), ('expires_at', 1)])
+
+def _public_offer(offer: dict) -> dict:
+    offer = public_money(offer, 'order_offers')
+    for field in ('_id', 'user_id', 'status', 'created_at', 'expires_at'):
+        offer.pop(field, None)
+    return offer
+
+async def get_open_offers(user_id: str, vip_level: dict) -> tuple:
+    """Open offers for the user, generating a batch if none are left.
+
+    Batch documents are keyed by (user, slot, index), so concurrent first
+    loads in the same slot insert the same documents instead of racing.
+    Returns (offers, next_batch_at); once this slot's batch has been used up
+    the offers are empty and `next_batch_at` says when the next slot opens.
+    """
+    now = datetime.now(timezone.utc)
+    query = {'user_id': user_id, 'status': 'offered', 'expires_at': {'$gt': now}}
+    offers = await db.order_offers.find(query).sort('_id', 1).to_list(100)
+    if offers:
+        return offers, None
+    
+    slot = int(now.timestamp()) // ORDER_SLOT_SECONDS
+    if await db.order_offers.find_one({'_id': {'$regex': f"^{re.escape(user_id)}:{slot}:"}}, {'_id': 1}):
+        next_batch_at = datetime.fromtimestamp((slot + 1) * ORDER_SLOT_SECONDS, timezone.utc)
+        return [], next_batch_at
+    
+    cashback = to_cents(vip_level['commission_per_order'])
+    batch = []
+    for i in range(min(3, vip_level['orders_per_day'])):
+        product = random.choice(ORDER_PRODUCTS)
+        price_variation = random.uniform(0.9, 1.2)
+        product_price = round(product['base_price'] * price_variation, 2)
+        order_id = str(uuid.uuid4())
+        product_code = f"{product['category'][:3].upper()}{random.randint(10000, 99999)}"
+        qr_data = f"ORDER:{order_id}|PRODUCT:{product_code}|PRICE:{product_price}|CASHBACK:{from_cents(cashback)}"
+        batch.append({
+            '_id': f"{user_id}:{slot}:{i}",
+            'id': order_id,
+            'user_id': user_id,
+            'product_name': product['name'],
+            'product_code': product_code,
+            'product_price': to_cents(product_price),
+            'cashback': cashback,
+            'qr_code': generate_qr_code(qr_data),
+            'category': product['category'],
+            'status': 'offered',
+            'created_at': now.isoformat(),
+            'expires_at': now + timedelta(minutes=ORDER_OFFER_TTL_MINUTES)
+        })
+    if batch:
+        await db.order_offers.bulk_write([
+            UpdateOne({'_id': offer['_id']}, {'$setOnInsert': offer}, upsert=True) for offer in batch
+        ], ordered=False)
+    return await db.order_offers.find(query).sort('_id', 1).to_list(100), None
+
 @api_router.get("/orders/available")
 async def get_available_orders(current_user: dict = Depends(get_current_user)):
     if current_user['vip_level'] == 0:
         return {'orders': [], 'message': 'VIP səviyyəsi yoxdur. Depozit edin.'}
     
     # Get VIP level details
-    vip_level = await db.vip_levels.find_one({'level': current_user['vip_level']}, {'_id': 0})
+    vip_level = await get_vip_level(current_user['vip_level'])
     if not vip_level:
         return {'orders': [], 'message': 'VIP məlumatları tapılmadı'}
     
     # Check daily earnings limit
     today = datetime.now(timezone.utc).date().isoformat()
     
-    # Reset daily earnings if new day
-    user_last_reset = await db.daily_reset.find_one({'user_id': current_user['id']}, {'_id': 0})
-    if not user_last_reset or user_last_reset.get('date') != today:
+    # Reset daily earnings if new day; the date guard keeps a concurrent reset idempotent
+    if (current_user.get('daily_reset') or {}).get('date') != today:
         await db.users.update_one(
-            {'id': current_user['id']},
-            {'$set': {'daily_earnings': 0}}
-        )
-        await db.daily_reset.update_one(
-            {'user_id': current_user['id']},
-            {'$set': {'date': today}},
-            upsert=True
+            {'id': current_user['id'], 'daily_reset.date': {'$ne': today}},
+            {'$set': {'daily_earnings': 0, 'daily_reset.date': today}}
         )
         current_user['daily_earnings'] = 0
     
-    if current_user['daily_earnings'] >= vip_level['max_daily_earnings']:
+    max_daily = to_cents(vip_level['max_daily_earnings'])
+    if current_user['daily_earnings'] >= max_daily:
         return {'orders': [], 'message': 'Gündəlik limit dolub'}
     
-    # Generate orders
-    products = [
-        {'name': 'Faberlic Expert Pharma Krem', 'base_price': 45.99, 'category': 'Kosmetika'},
-        {'name': 'Oriflame The ONE Ruj', 'base_price': 18.50, 'category': 'Makeup'},
-        {'name': 'Faberlic Oxygen Serum', 'base_price': 67.00, 'category': 'Dəri Baxımı'},
-        {'name': 'Oriflame Eclat Parfüm', 'base_price': 89.99, 'category': 'Parfüm'},
-        {'name': 'Faberlic Fitness Body Krem', 'base_price': 32.50, 'category': 'Bədən Baxımı'},
-        {'name': 'Oriflame Giordani Gold Parfüm', 'base_price': 125.00, 'category': 'Parfüm'},
-        {'name': 'Faberlic Expert Pharma Şampun', 'base_price': 28.75, 'category': 'Saç Baxımı'},
-        {'name': 'Oriflame NovAge Serum', 'base_price': 95.50, 'category': 'Dəri Baxımı'},
-        {'name': 'Faberlic Home Aromatherapy', 'base_price': 41.25, 'category': 'Ev üçün'},
-        {'name': 'Oriflame The ONE İllumina', 'base_price': 22.99, 'category': 'Makeup'},
-    ]
+    offers, next_batch_at = await get_open_offers(current_user['id'], vip_level)
     
     orders = []
-    remaining = vip_level['max_daily_earnings'] - current_user['daily_earnings']
-    
-    for i in range(min(3, vip_level['orders_per_day'])):
-        product = random.choice(products)
-        price_variation = random.uniform(0.9, 1.2)
-        product_price = round(product['base_price'] * price_variation, 2)
-        cashback = vip_level['commission_per_order']
-        
-        if cashback > remaining:
+    remaining = max_daily - current_user['daily_earnings']
+    for offer in offers:
+        if offer['cashback'] > remaining:
             break
-        
-        order_id = str(uuid.uuid4())
-        product_code = f"{product['category'][:3].upper()}{random.randint(10000, 99999)}"
-        qr_data = f"ORDER:{order_id}|PRODUCT:{product_code}|PRICE:{product_price}|CASHBACK:{cashback}"
-        qr_code_b64 = generate_qr_code(qr_data)
-        
-        orders.append({
-            'id': order_id,
-            'product_name': product['name'],
-            'product_code': product_code,
-            'product_price': product_price,
-            'cashback': cashback,
-            'qr_code': qr_code_b64,
-            'category': product['category']
-        })
-        remaining -= cashback
+        orders.append(_public_offer(offer))
+        remaining -= offer['cashback']
     
-    return {'orders': orders, 'daily_earnings': current_user['daily_earnings'], 'max_earnings': vip_level['max_daily_earnings']}
+    result = {'orders': orders, 'daily_earnings': from_cents(current_user['daily_earnings']), 'max_earnings': vip_level['max_daily_earnings']}
+    if next_batch_at:
+        result['next_orders_at'] = next_batch_at.isoformat()
+    return result
 
 @api_router.post("/orders/accept/{order_id}")
 async def accept_order(order_id: str, current_user: dict = Depends(get_current_user)):
-    # Check if order already exists
-    existing = await db.orders.find_one({'id': order_id}, {'_id': 0})
-    if existing:
-        raise HTTPException(status_code=400, detail="Sifariş artıq qəbul edilib")
-    
-    # Simulate order processing
-    vip_level = await db.vip_levels.find_one({'level': current_user['vip_level']}, {'_id': 0})
+    vip_level = await get_vip_level(current_user['vip_level'])
     if not vip_level:
         raise HTTPException(status_code=400, detail="VIP məlumatları tapılmadı")
     
-    cashback = vip_level['commission_per_order']
-    now = datetime.now(timezone.utc).isoformat()
+    # Claim the offer; only an open offer made to this user can be accepted, once
+    now_dt = datetime.now(timezone.utc)
+    now = now_dt.isoformat()
+    offer = await db.order_offers.find_one_and_update(
+        {'id': order_id, 'user_id': current_user['id'], 'status': 'offered', 'expires_at': {'$gt': now_dt}},
+        {'$set': {'status': 'accepted', 'accepted_at': now}}
+    )
+    if not offer:
+        raise HTTPException(status_code=400, detail="Sifariş tapılmadı və ya artıq qəbul edilib")
     
-    # Update balances
-    new_balance = current_user['balance'] + cashback
-    new_daily = current_user['daily_earnings'] + cashback
-    new_total = current_user['total_earnings'] + cashback
+    cashback = offer['cashback']
+    max_daily = to_cents(vip_level['max_daily_earnings'])
     
-    await db.users.update_one(
-        {'id': current_user['id']},
-        {'$set': {
-            'balance': new_balance,
-            'daily_earnings': new_daily,
-            'total_earnings': new_total
-        }}
-    )
+    # Update balances
+    user = await inc_user_money(current_user['id'], {
+        'balance': cashback,
+        'daily_earnings': cashback,
+        'total_earnings': cashback
+    }, guard={'daily_earnings': {'$lte': max_daily - cashback}})
+    if not user:
+        await db.order_offers.update_one({'_id': offer['_id']}, {'$set': {'status': 'offered'}, '$unset': {'accepted_at': ''}})
+        raise HTTPException(status_code=400, detail="Gündəlik limit dolub")
     
     # Create order record
     order_data = {
         'id': order_id,
         'user_id': current_user['id'],
-        'product_name': 'Order Product',
-        'product_code': f"ORD{random.randint(10000, 99999)}",
-        'product_price': cashback * 20,
+        'product_name': offer['product_name'],
+        'product_code': offer['product_code'],
+        'product_price': offer['product_price'],
         'cashback': cashback,
         'qr_code': '',
         'status': 'completed',
-        'created_at': now,
+        'created_at': offer['created_at'],
         'completed_at': now
     }
     await db.orders.insert_one(order_data)
@@ -440,93 +1488,155 @@ async def accept_order(order_id: str, current_user: dict = Depends(get_current_u
         'created_at': now,
         'completed_at': now
     }
-    await db.transactions.insert_one(tx_data)
+    await write_behind.insert('transactions', tx_data)
+    await record_daily_earning(current_user['id'], 'order', cashback)
+    leaderboard.observe(user)
     
-    return {'success': True, 'cashback': cashback, 'new_balance': new_balance}
+    return {'success': True, 'cashback': from_cents(cashback), 'new_balance': from_cents(user['balance'])}
 
 @api_router.post("/orders/reject/{order_id}")
 async def reject_order(order_id: str, current_user: dict = Depends(get_current_user)):
+    await db.order_offers.update_one(
+        {'id': order_id, 'user_id': current_user['id'], 'status': 'offered'},
+        {'$set': {'status': 'rejected', 'rejected_at': datetime.now(timezone.utc).isoformat()}}
+    )
     # Just return success after 60 second wait notification
     return {'success': True, 'wait_time': 60}
 
-# Mining endpoints
-@api_router.get("/mining/status")
-async def get_mining_status(current_user: dict = Depends(get_current_user)):
-    mining = await db.mining.find_one({'user_id': current_user['id']}, {'_id': 0})
-    if not mining:
-        now = datetime.now(timezone.utc).isoformat()
-        mining = {
-            'user_id': current_user['id'],
-            'tap_count': 0,
-            'last_tap_time': None,
-            'daily_taps': 0,
-            'last_reset': now
-        }
-        await db.mining.insert_one(mining)
-    
-    # Check if we need to reset (6 hour window)
-    if mining['last_tap_time']:
-        last_tap = datetime.fromisoformat(mining['last_tap_time'])
-        now = datetime.now(timezone.utc)
-        hours_passed = (now - last_tap).total_seconds() / 3600
-        
-        if hours_passed >= 6:
-            # Reset tap count
-            await db.mining.update_one(
-                {'user_id': current_user['id']},
-                {'$set': {'tap_count': 0}}
-            )
-            mining['tap_count'] = 0
-    
-    return mining
+# Reward engine
+# Spin/mining parameters live in `reward_config` and are cached per process;
+# an admin edit bumps the bus version and every worker rebuilds its sampler.
+DEFAULT_REWARD_CONFIG = {
+    'spin_rewards': [
+        {'amount': 0.5, 'weight': 1},
+        {'amount': 1, 'weight': 2},
+        {'amount': 2, 'weight': 2},
+        {'amount': 5, 'weight': 2},
+        {'amount': 10, 'weight': 1},
+    ],
+    'mining_reward': 0.01,
+    'mining_tap_limit': 500,
+    'mining_window_hours': 6,
+}
 
-@api_router.post("/mining/tap")
-async def tap_mining(current_user: dict = Depends(get_current_user)):
-    mining = await db.mining.find_one({'user_id': current_user['id']}, {'_id': 0})
-    if not mining:
-        raise HTTPException(status_code=404, detail="Mining məlumatları tapılmadı")
-    
-    now = datetime.now(timezone.utc)
+class AliasSampler:
+    """Walker/Vose alias table: O(n) build, O(1) weighted sampling."""
+
+    def __init__(self, values: list, weights: List[float]):
+        n = len(values)
+        total = float(sum(weights))
+        scaled = [w * n / total for w in weights]
+        self.values = values
+        self.prob = [0.0] * n
+        self.alias = [0] * n
+        small = [i for i, p in enumerate(scaled) if p < 1.0]
+        large = [i for i, p in enumerate(scaled) if p >= 1.0]
+        while small and large:
+            s, l = small.pop(), large.pop()
+            self.prob[s] = scaled[s]
+            self.alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            (small if scaled[l] < 1.0 else large).append(l)
+        for i in small + large:
+            self.prob[i] = 1.0
+
+    def sample(self, rng=random):
+        i = rng.randrange(len(self.values))
+        return self.values[i] if rng.random() < self.prob[i] else self.values[self.alias[i]]
+
+class RewardConfig:
+    def __init__(self, doc: dict):
+        self.doc = doc
+        self.mining_reward = to_cents(doc['mining_reward'])
+        self.mining_tap_limit = int(doc['mining_tap_limit'])
+        self.mining_window_hours = float(doc['mining_window_hours'])
+        rewards = doc['spin_rewards']
+        self.spin_sampler = AliasSampler([to_cents(r['amount']) for r in rewards], [r['weight'] for r in rewards])
+
+    def sample_spin(self) -> int:
+        return self.spin_sampler.sample()
+
+reward_config_cache = ProcessCache(cache_bus, 'reward_config')
+
+async def _fetch_reward_config() -> RewardConfig:
+    doc = await db.reward_config.find_one({'_id': 'default'}, {'_id': 0}) or {}
+    return RewardConfig({**DEFAULT_REWARD_CONFIG, **doc})
+
+async def get_reward_config() -> RewardConfig:
+    return await reward_config_cache.get_or_load('default', _fetch_reward_config)
+
+@api_router.get("/admin/reward-config")
+async def admin_get_reward_config(current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    # Check if we need to reset (every 6 hours)
-    if mining.get('last_tap_time'):
-        last_tap = datetime.fromisoformat(mining['last_tap_time'])
-        hours_passed = (now - last_tap).total_seconds() / 3600
-        
-        if hours_passed >= 6:
-            # Reset for new 6-hour period
-            await db.mining.update_one(
-                {'user_id': current_user['id']},
-                {'$set': {'tap_count': 0}}
-            )
-            mining['tap_count'] = 0
+    config = await get_reward_config()
+    return config.doc
+
+@api_router.put("/admin/reward-config")
+async def admin_update_reward_config(update: RewardConfigUpdate, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    if mining.get('tap_count', 0) >= 500:
-        raise HTTPException(status_code=400, detail="Limit doldu. 6 saat sonra yenidən.")
+    changes = update.model_dump(exclude_none=True)
+    if 'spin_rewards' in changes and not changes['spin_rewards']:
+        raise HTTPException(status_code=400, detail="Çarx mükafatları boş ola bilməz")
     
-    # Add tap
-    new_tap_count = mining.get('tap_count', 0) + 1
-    reward = 0.01
+    changes['updated_at'] = datetime.now(timezone.utc).isoformat()
+    await db.reward_config.update_one({'_id': 'default'}, {'$set': changes, '$inc': {'version': 1}}, upsert=True)
+    await reward_config_cache.invalidate()
+    return {'success': True}
+
+# Mining endpoints
+def mining_window_expired(mining: dict, now: datetime, config) -> bool:
+    if not mining.get('last_tap_time'):
+        return False
+    hours_passed = (now - datetime.fromisoformat(mining['last_tap_time'])).total_seconds() / 3600
+    return hours_passed >= config.mining_window_hours
+
+@api_router.get("/mining/status")
+async def get_mining_status(current_user: dict = Depends(get_current_user)):
+    mining = MiningState(**(current_user.get('mining') or {})).model_dump()
     
-    new_balance = current_user['balance'] + reward
-    new_total = current_user['total_earnings'] + reward
+    # An expired window reads as reset; the next tap persists it
+    config = await get_reward_config()
+    if mining_window_expired(mining, datetime.now(timezone.utc), config):
+        mining['tap_count'] = 0
     
-    await db.mining.update_one(
-        {'user_id': current_user['id']},
-        {'$set': {
-            'tap_count': new_tap_count,
-            'last_tap_time': now.isoformat(),
-            'daily_taps': mining.get('daily_taps', 0) + 1
-        }}
-    )
+    return {
+        'user_id': current_user['id'],
+        **mining,
+        'mining_tap_limit': config.mining_tap_limit,
+        'mining_window_hours': config.mining_window_hours,
+        'mining_reward': from_cents(config.mining_reward),
+    }
+
+@api_router.post("/mining/tap")
+async def tap_mining(current_user: dict = Depends(get_current_user)):
+    mining = current_user.get('mining') or {}
+    now = datetime.now(timezone.utc)
+    config = await get_reward_config()
+    reward = config.mining_reward
+    inc = {'mining.daily_taps': 1, 'balance': reward, 'total_earnings': reward}
+    
+    user = None
+    if mining_window_expired(mining, now, config):
+        # Start a new window, unless a concurrent tap already did
+        user = await inc_user_money(
+            current_user['id'], inc,
+            guard={'mining.last_tap_time': mining['last_tap_time']},
+            set_fields={'mining.tap_count': 1, 'mining.last_tap_time': now.isoformat()}
+        )
+    if user is None:
+        user = await inc_user_money(
+            current_user['id'], {**inc, 'mining.tap_count': 1},
+            guard={'mining.tap_count': {'$not': {'$gte': config.mining_tap_limit}}},
+            set_fields={'mining.last_tap_time': now.isoformat()}
+        )
+    if user is None:
+        raise HTTPException(status_code=400, detail=f"Limit doldu. {config.mining_window_hours:g} saat sonra yenidən.")
     
-    await db.users.update_one(
-        {'id': current_user['id']},
-        {'$set': {
-            'balance': new_balance,
-            'total_earnings': new_total
-        }}
-    )
+    new_tap_count = user['mining']['tap_count']
     
     # Create transaction
     tx_data = {
@@ -538,46 +1648,34 @@ async def tap_mining(current_user: dict = Depends(get_current_user)):
         'created_at': now.isoformat(),
         'completed_at': now.isoformat()
     }
-    await db.transactions.insert_one(tx_data)
+    await write_behind.insert('transactions', tx_data)
+    await record_daily_earning(current_user['id'], 'mining', reward)
+    leaderboard.observe(user)
     
-    return {'success': True, 'tap_count': new_tap_count, 'reward': reward, 'new_balance': new_balance, 'remaining': 500 - new_tap_count}
+    return {'success': True, 'tap_count': new_tap_count, 'reward': from_cents(reward), 'new_balance': from_cents(user['balance']), 'remaining': config.mining_tap_limit - new_tap_count}
 
 # Spin endpoints
 @api_router.post("/spin/daily")
 async def daily_spin(current_user: dict = Depends(get_current_user)):
     today = datetime.now(timezone.utc).date().isoformat()
     
-    spin = await db.spins.find_one({'user_id': current_user['id']}, {'_id': 0})
-    if not spin:
-        spin = {'user_id': current_user['id'], 'last_spin_date': '', 'total_spins': 0}
-        await db.spins.insert_one(spin)
-    
-    if spin['last_spin_date'] == today:
+    if (current_user.get('spin') or {}).get('last_spin_date') == today:
         raise HTTPException(status_code=400, detail="Bu gün artıq çarx çevirdiniz")
     
-    # Rewards: 0.5, 1, 2, 5, 10, 20 USDT
-    rewards = [0.5, 1, 1, 2, 2, 5, 5, 10]
-    reward = random.choice(rewards)
+    # Weighted reward table from the reward config
+    reward = (await get_reward_config()).sample_spin()
     
     now = datetime.now(timezone.utc).isoformat()
-    new_balance = current_user['balance'] + reward
-    new_total = current_user['total_earnings'] + reward
-    
-    await db.spins.update_one(
-        {'user_id': current_user['id']},
-        {'$set': {
-            'last_spin_date': today,
-            'total_spins': spin['total_spins'] + 1
-        }}
-    )
     
-    await db.users.update_one(
-        {'id': current_user['id']},
-        {'$set': {
-            'balance': new_balance,
-            'total_earnings': new_total
-        }}
+    # Guarding on the spin date makes a second concurrent spin miss
+    user = await inc_user_money(
+        current_user['id'],
+        {'spin.total_spins': 1, 'balance': reward, 'total_earnings': reward},
+        guard={'spin.last_spin_date': {'$ne': today}},
+        set_fields={'spin.last_spin_date': today}
     )
+    if not user:
+        raise HTTPException(status_code=400, detail="Bu gün artıq çarx çevirdiniz")
     
     # Create transaction
     tx_data = {
@@ -589,9 +1687,34 @@ async def daily_spin(current_user: dict = Depends(get_current_user)):
         'created_at': now,
         'completed_at': now
     }
-    await db.transactions.insert_one(tx_data)
+    await write_behind.insert('transactions', tx_data)
+    await record_daily_earning(current_user['id'], 'spin', reward)
+    leaderboard.observe(user)
     
-    return {'success': True, 'reward': reward, 'new_balance': new_balance}
+    return {'success': True, 'reward': from_cents(reward), 'new_balance': from_cents(user['balance'])}
+
+@startup_phase('embed_user_state')
+async def migrate_embed_user_state():
+    """Fold the legacy `mining`, `spins` and `daily_reset` collections into user sub-documents."""
+    sources = (
+        ('mining', 'mining', MiningState),
+        ('spins', 'spin', SpinState),
+        ('daily_reset', 'daily_reset', DailyResetState),
+    )
+    async def migrate():
+        for collection, field, model in sources:
+            batch = []
+            async for doc in db[collection].find({}, {'_id': 0}):
+                state = model(**{k: v for k, v in doc.items() if k in model.model_fields}).model_dump()
+                batch.append(UpdateOne({'id': doc['user_id']}, {'$set': {field: state}}))
+                if len(batch) >= 1000:
+                    await db.users.bulk_write(batch, ordered=False)
+                    batch = []
+            if batch:
+                await db.users.bulk_write(batch, ordered=False)
+            await db.users.update_many({field: {'$exists': False}}, {'$set': {field: model().model_dump()}})
+    if await run_migration('embed_user_state', migrate):
+        logging.info("Embedded mining, spin and daily reset state into user documents")
 
 # Transaction endpoints
 @api_router.post("/transactions/deposit")
@@ -606,7 +1729,7 @@ async def create_deposit(amount: float, current_user: dict = Depends(get_current
         'id': tx_id,
         'user_id': current_user['id'],
         'type': 'deposit',
-        'amount': amount,
+        'amount': to_cents(amount),
         'status': 'pending',
         'wallet_address': 'TG1CF2xwduAtw7P8GTbePkkMkPXsVoDBEZ',
         'created_at': now,
@@ -621,24 +1744,20 @@ async def create_withdrawal(amount: float, wallet_address: str, current_user: di
     if amount < 250:
         raise HTTPException(status_code=400, detail="Minimum çıxarış 250 USDT")
     
-    if current_user['balance'] < amount:
-        raise HTTPException(status_code=400, detail="Kifayət qədər balans yoxdur")
-    
+    amount_cents = to_cents(amount)
     tx_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
     
     # Deduct from balance immediately
-    new_balance = current_user['balance'] - amount
-    await db.users.update_one(
-        {'id': current_user['id']},
-        {'$set': {'balance': new_balance}}
-    )
+    user = await inc_user_money(current_user['id'], {'balance': -amount_cents}, guard={'balance': {'$gte': amount_cents}})
+    if not user:
+        raise HTTPException(status_code=400, detail="Kifayət qədər balans yoxdur")
     
     tx_data = {
         'id': tx_id,
         'user_id': current_user['id'],
         'type': 'withdraw',
-        'amount': amount,
+        'amount': amount_cents,
         'status': 'pending',
         'wallet_address': wallet_address,
         'created_at': now,
@@ -646,15 +1765,514 @@ async def create_withdrawal(amount: float, wallet_address: str, current_user: di
     }
     await db.transactions.insert_one(tx_data)
     
-    return {'success': True, 'transaction_id': tx_id, 'new_balance': new_balance}
+    return {'success': True, 'transaction_id': tx_id, 'new_balance': from_cents(user['balance'])}
+
+@startup_phase('money_to_cents')
+async def migrate_money_to_cents():
+    async def migrate():
+        archives = await db.archive_catalog.distinct('_id')
+        targets = list(MONEY_FIELDS.items()) + [(name, MONEY_FIELDS['transactions']) for name in archives]
+        for collection, fields in targets:
+            # The marker makes a re-run after a crash skip documents already converted
+            await db[collection].update_many({'money_unit': {'$ne': 'cents'}}, [{'$set': {
+                **{field: {'$toLong': {'$round': [{'$multiply': [{'$ifNull': [f'${field}', 0]}, 100]}, 0]}}
+                   for field in fields},
+                'money_unit': 'cents'
+            }}])
+    if await run_migration('money_to_cents', migrate):
+        logging.info("Migrated ledger money fields to integer cents")
 
 @api_router.get("/transactions/history")
 async def get_transaction_history(current_user: dict = Depends(get_current_user)):
-    transactions = await db.transactions.find(
-        {'user_id': current_user['id']},
+    transactions = await find_transactions({'user_id': current_user['id']}, 100)
+    return [public_money(tx, 'transactions') for tx in transactions]
+
+# Daily earnings rollup
+# One `user_daily_stats` document per user per UTC day, maintained with
+# upserted $inc by every earning path so charts never scan the ledger.
+EARNING_SOURCES = ('order', 'mining', 'spin', 'farm')
+MAX_STATS_DAYS = 366
+
+@startup_phase('daily_stats_indexes')
+async def ensure_daily_stats_indexes():
+    await db.user_daily_stats.create_index([('user_id', 1), ('date', 1)], unique=True)
+
+async def record_daily_earning(user_id: str, source: str, amount: int, when: Optional[datetime] = None):
+    day = (when or datetime.now(timezone.utc)).date().isoformat()
+    await db.user_daily_stats.update_one(
+        {'user_id': user_id, 'date': day},
+        {'$inc': {source: amount, f'{source}_count': 1, 'total': amount}},
+        upsert=True
+    )
+
+@api_router.get("/stats/daily")
+async def get_daily_stats(days: int = 30, current_user: dict = Depends(get_current_user)):
+    days = max(1, min(days, MAX_STATS_DAYS))
+    today = datetime.now(timezone.utc).date()
+    start = (today - timedelta(days=days - 1)).isoformat()
+    
+    rows = await db.user_daily_stats.find(
+        {'user_id': current_user['id'], 'date': {'$gte': start}},
         {'_id': 0}
-    ).sort('created_at', -1).to_list(100)
-    return transactions
+    ).to_list(days)
+    by_date = {row['date']: row for row in rows}
+    
+    stats = []
+    for offset in range(days - 1, -1, -1):
+        day = (today - timedelta(days=offset)).isoformat()
+        row = by_date.get(day, {})
+        entry = {'date': day, 'total': from_cents(row.get('total', 0))}
+        for source in EARNING_SOURCES:
+            entry[source] = from_cents(row.get(source, 0))
+            entry[f'{source}_count'] = row.get(f'{source}_count', 0)
+        stats.append(entry)
+    return stats
+
+# Earnings leaderboard
+# Each worker keeps the top LEADERBOARD_SIZE users by total_earnings in a sorted
+# list, fed by its own earning events and re-seeded from the total_earnings
+# index so other workers' events show up within LEADERBOARD_REFRESH_SECONDS.
+# Ranks below the top come from a periodic earnings histogram.
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', '100'))
+LEADERBOARD_REFRESH_SECONDS = float(os.environ.get('LEADERBOARD_REFRESH_SECONDS', '30'))
+LEADERBOARD_HISTOGRAM_SECONDS = float(os.environ.get('LEADERBOARD_HISTOGRAM_SECONDS', '300'))
+# 1-2-5 bucket boundaries in cents, 0.01 up to 5 billion USDT
+LEADERBOARD_BUCKETS = [0] + [m * 10 ** e for e in range(12) for m in (1, 2, 5)]
+
+# Admins and users without numeric earnings are left out of ranking entirely
+LEADERBOARD_FILTER = {'total_earnings': {'$type': 'number'}, 'role': {'$ne': 'admin'}}
+
+class Leaderboard:
+    def __init__(self, size: int):
+        self.size = size
+        self._keys = []  # sorted (-total_earnings, user_id)
+        self._entries = {}
+        self._histogram = None  # (lower bounds, counts, count above the last bound), highest bucket first
+
+    @staticmethod
+    def _entry(user: dict) -> dict:
+        return {'user_id': user['id'], 'login': user.get('login', ''), 'total_earnings': user.get('total_earnings', 0)}
+
+    @staticmethod
+    def ranked(user: dict) -> bool:
+        earnings = user.get('total_earnings')
+        return user.get('role') != 'admin' and isinstance(earnings, (int, float)) and not isinstance(earnings, bool)
+
+    def load(self, users: List[dict]):
+        entries = {user['id']: self._entry(user) for user in users}
+        self._keys = sorted((-entry['total_earnings'], user_id) for user_id, entry in entries.items())[:self.size]
+        self._entries = {user_id: entries[user_id] for _, user_id in self._keys}
+
+    def observe(self, user: dict):
+        """Apply a user's new total_earnings; O(log K) unless it can't make the top."""
+        current = self._entries.get(user['id'])
+        if current is not None:
+            del self._keys[bisect_left(self._keys, (-current['total_earnings'], user['id']))]
+            del self._entries[user['id']]
+        if not self.ranked(user):
+            return
+        entry = self._entry(user)
+        key = (-entry['total_earnings'], entry['user_id'])
+        if current is None and len(self._keys) >= self.size and key >= self._keys[-1]:
+            return
+        insort(self._keys, key)
+        self._entries[entry['user_id']] = entry
+        if len(self._keys) > self.size:
+            _, dropped = self._keys.pop()
+            del self._entries[dropped]
+
+    def page(self, offset: int, limit: int) -> List[dict]:
+        return [
+            {'rank': offset + i + 1, **self._entries[user_id]}
+            for i, (_, user_id) in enumerate(self._keys[offset:offset + limit])
+        ]
+
+    def set_histogram(self, rows: List[dict]):
+        counts = {row['_id']: row['count'] for row in rows}
+        bounds = sorted((bound for bound in counts if isinstance(bound, int)), reverse=True)
+        self._histogram = (bounds, [counts[bound] for bound in bounds], counts.get('other', 0))
+
+    def rank(self, user_id: str, total: int) -> dict:
+        current = self._entries.get(user_id)
+        if current is not None:
+            index = bisect_left(self._keys, (-current['total_earnings'], user_id))
+            return {'rank': index + 1, 'exact': True}
+        # Outside the top: users in higher buckets plus a linear share of the user's own bucket
+        above = 0
+        if self._histogram:
+            bounds, counts, above = self._histogram
+            upper = None
+            for bound, count in zip(bounds, counts):
+                if total >= bound:
+                    if upper is not None and upper > bound:
+                        above += int(count * (upper - 1 - total) / (upper - bound))
+                    break
+                above += count
+                upper = bound
+        return {'rank': max(above + 1, len(self._keys) + 1), 'exact': False}
+
+leaderboard = Leaderboard(LEADERBOARD_SIZE)
+
+async def refresh_leaderboard():
+    users = await analytics_db.users.find(
+        LEADERBOARD_FILTER, {'_id': 0, 'id': 1, 'login': 1, 'total_earnings': 1}
+    ).sort('total_earnings', -1).limit(LEADERBOARD_SIZE).to_list(LEADERBOARD_SIZE)
+    leaderboard.load(users)
+
+async def refresh_leaderboard_histogram():
+    rows = await analytics_db.users.aggregate([
+        {'$match': LEADERBOARD_FILTER},
+        {'$bucket': {
+            'groupBy': '$total_earnings',
+            'boundaries': LEADERBOARD_BUCKETS,
+            'default': 'other',
+            'output': {'count': {'$sum': 1}}
+        }}
+    ], allowDiskUse=True).to_list(None)
+    leaderboard.set_histogram(rows)
+
+async def _leaderboard_loop():
+    last_histogram = 0.0
+    while True:
+        try:
+            if time.monotonic() - last_histogram >= LEADERBOARD_HISTOGRAM_SECONDS:
+                await refresh_leaderboard_histogram()
+                last_histogram = time.monotonic()
+            await asyncio.sleep(LEADERBOARD_REFRESH_SECONDS)
+            await refresh_leaderboard()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Leaderboard refresh failed: {str(e)}")
+            await asyncio.sleep(LEADERBOARD_REFRESH_SECONDS)
+
+@startup_phase('leaderboard')
+async def start_leaderboard():
+    await db.users.create_index([('total_earnings', -1)])
+    await refresh_leaderboard()
+    # Every worker keeps its own copy, so this loop is deliberately lease-free
+    background_tasks.append(asyncio.create_task(_leaderboard_loop()))
+
+def _mask_login(login: str) -> str:
+    return f"{login[:2]}***" if login else '***'
+
+@api_router.get("/leaderboard")
+async def get_leaderboard(offset: int = 0, limit: int = 20, payload: dict = Depends(get_token_payload)):
+    offset = max(0, min(offset, LEADERBOARD_SIZE))
+    limit = max(1, min(limit, 100))
+    items = [
+        {'rank': entry['rank'], 'login': _mask_login(entry['login']), 'total_earnings': from_cents(entry['total_earnings']),
+         'is_me': entry['user_id'] == payload['user_id']}
+        for entry in leaderboard.page(offset, limit)
+    ]
+    return {'items': items, 'offset': offset, 'limit': limit, 'size': LEADERBOARD_SIZE}
+
+@api_router.get("/leaderboard/me")
+async def get_my_rank(current_user: dict = Depends(get_current_user)):
+    total = current_user.get('total_earnings') or 0
+    if not leaderboard.ranked(current_user):
+        return {'rank': None, 'exact': True, 'total_earnings': from_cents(total)}
+    return {**leaderboard.rank(current_user['id'], total), 'total_earnings': from_cents(total)}
+
+# Transaction archive
+# Settled transactions older than the horizon move to monthly
+# `transactions_archive_YYYY_MM` collections; readers walk hot then cold.
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', '1000'))
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get('ARCHIVE_INTERVAL_HOURS', '0'))  # 0 disables the scheduled job
+archives_cache = ProcessCache(cache_bus, 'transaction_archives')
+
+def archive_collection_name(created_at: str) -> str:
+    return f"transactions_archive_{created_at[:4]}_{created_at[5:7]}"
+
+async def _fetch_archive_collections() -> List[str]:
+    entries = await db.archive_catalog.find({}, {'_id': 1}).sort('_id', -1).to_list(None)
+    return [entry['_id'] for entry in entries]
+
+async def get_archive_collections() -> List[str]:
+    """Archive collection names, newest month first."""
+    return await archives_cache.get_or_load('all', _fetch_archive_collections)
+
+async def _register_archive_collection(name: str):
+    result = await db.archive_catalog.update_one({'_id': name}, {'$setOnInsert': {'created_at': datetime.now(timezone.utc).isoformat()}}, upsert=True)
+    if result.upserted_id is not None:
+        await db[name].create_index('id', unique=True)
+        await db[name].create_index([('user_id', 1), ('created_at', -1)])
+        await archives_cache.invalidate()
+
+async def archive_transactions(older_than_days: int = ARCHIVE_AFTER_DAYS) -> dict:
+    """Move settled transactions older than the horizon out of the hot collection.
+
+    Rows are copied before they are deleted and the archive has a unique
+    index on `id`, so an interrupted run is simply repeated.
+    """
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=older_than_days)).isoformat()
+    query = {'status': {'$in': ['completed', 'rejected']}, 'created_at': {'$lt': cutoff}}
+    moved = 0
+    while True:
+        batch = await db.transactions.find(query, {'_id': 0}).sort('created_at', 1).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        by_month = {}
+        for tx in batch:
+            by_month.setdefault(archive_collection_name(tx['created_at']), []).append(tx)
+        for name, docs in by_month.items():
+            await _register_archive_collection(name)
+            await db[name].bulk_write([
+                UpdateOne({'id': doc['id']}, {'$setOnInsert': doc}, upsert=True) for doc in docs
+            ], ordered=False)
+        await db.transactions.delete_many({'id': {'$in': [tx['id'] for tx in batch]}})
+        moved += len(batch)
+    if moved:
+        logging.info(f"Archived {moved} transactions older than {cutoff}")
+    return {'archived': moved, 'cutoff': cutoff}
+
+def _archives_in_range(names: List[str], query: dict) -> List[str]:
+    created = query.get('created_at') or {}
+    if not isinstance(created, dict):
+        return names
+    lower = created.get('$gte') or created.get('$gt')
+    upper = created.get('$lte') or created.get('$lt')
+    return [
+        name for name in names
+        if (not lower or name >= archive_collection_name(lower))
+        and (not upper or name <= archive_collection_name(upper))
+    ]
+
+async def find_transactions(query: dict, limit: int, database=None) -> List[dict]:
+    """Newest-first transactions matching `query` across the hot and archive tiers."""
+    database = database if database is not None else db
+    results = await database.transactions.find(query, {'_id': 0}).sort('created_at', -1).to_list(limit)
+    if len(results) < limit:
+        for name in _archives_in_range(await get_archive_collections(), query):
+            results += await database[name].find(query, {'_id': 0}).sort('created_at', -1).to_list(limit - len(results))
+            if len(results) >= limit:
+                break
+    return results
+
+async def iter_transactions(query: dict, database=None):
+    """Stream every transaction matching `query`, hot tier first, then archives newest first."""
+    database = database if database is not None else db
+    for name in ['transactions'] + _archives_in_range(await get_archive_collections(), query):
+        async for tx in database[name].find(query, {'_id': 0}).sort('created_at', -1):
+            yield tx
+
+@startup_phase('transaction_archive')
+async def schedule_transaction_archive():
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        run_periodic('archive_transactions', ARCHIVE_INTERVAL_HOURS * 3600, archive_transactions)
+
+# Balance reconciliation
+# Recomputes balance, total_earnings and deposit_amount from the ledger (hot and
+# archive tiers, plus farm purchases, which have no transaction row) and
+# merge-joins the per-user totals against `users`. The user id space is split
+# into ranges that are reconciled concurrently; every stream is a sorted
+# server-side aggregation, so memory stays flat however big the ledger is.
+RECONCILE_PARTITIONS = int(os.environ.get('RECONCILE_PARTITIONS', '16'))
+RECONCILE_CONCURRENCY = int(os.environ.get('RECONCILE_CONCURRENCY', '4'))
+RECONCILE_BATCH_SIZE = int(os.environ.get('RECONCILE_BATCH_SIZE', '1000'))
+RECONCILE_TOLERANCE_CENTS = int(os.environ.get('RECONCILE_TOLERANCE_CENTS', '0'))
+RECONCILE_INTERVAL_HOURS = float(os.environ.get('RECONCILE_INTERVAL_HOURS', '0'))  # 0 disables the scheduled job
+RECONCILED_FIELDS = ('balance', 'total_earnings', 'deposit_amount')
+
+def reconcile_partitions(count: int) -> List[dict]:
+    """Split user ids (uuid4 hex) into `count` contiguous ranges by leading character."""
+    digits = '0123456789abcdef'
+    count = max(1, min(count, len(digits)))
+    bounds = [None] + [digits[i * len(digits) // count] for i in range(1, count)] + [None]
+    ranges = []
+    for lower, upper in zip(bounds, bounds[1:]):
+        id_range = {}
+        if lower:
+            id_range['$gte'] = lower
+        if upper:
+            id_range['$lt'] = upper
+        ranges.append(id_range or {'$exists': True})
+    return ranges
+
+def _ledger_totals_pipeline(id_filter: dict, archives: List[str]) -> list:
+    def total(condition):
+        return {'$sum': {'$cond': [condition, '$amount', 0]}}
+    completed = {'$eq': ['$status', 'completed']}
+    match = {'$match': {'user_id': id_filter}}
+    return [match] + [
+        {'$unionWith': {'coll': name, 'pipeline': [match]}} for name in archives
+    ] + [
+        {'$group': {
+            '_id': '$user_id',
+            'earnings': total({'$and': [completed, {'$in': ['$type', list(EARNING_SOURCES)]}]}),
+            'deposits': total({'$and': [completed, {'$eq': ['$type', 'deposit']}]}),
+            'bonuses': total({'$and': [completed, {'$eq': ['$type', 'bonus']}]}),
+            # Withdrawals are debited on request and only refunded on rejection
+            'withdrawals': total({'$and': [{'$eq': ['$type', 'withdraw']}, {'$ne': ['$status', 'rejected']}]}),
+            'rows': {'$sum': 1},
+        }},
+        {'$sort': {'_id': 1}},
+    ]
+
+def _farm_spend_pipeline(id_filter: dict, animal_prices: dict) -> list:
+    # Farms bought before purchase_price was recorded fall back to today's catalog price
+    catalog_price = {'$switch': {
+        'branches': [{'case': {'$eq': ['$animal_id', animal_id]}, 'then': price} for animal_id, price in animal_prices.items()],
+        'default': 0
+    }} if animal_prices else 0
+    recorded = {'$gt': ['$purchase_price', 0]}
+    return [
+        {'$match': {'user_id': id_filter}},
+        {'$group': {
+            '_id': '$user_id',
+            'spent': {'$sum': {'$cond': [recorded, '$purchase_price', catalog_price]}},
+            'estimated': {'$sum': {'$cond': [recorded, 0, 1]}},
+        }},
+        {'$sort': {'_id': 1}},
+    ]
+
+def expected_user_money(totals: Optional[dict], farms: Optional[dict]) -> dict:
+    totals = totals or {}
+    spent = (farms or {}).get('spent', 0)
+    return {
+        'balance': (totals.get('deposits', 0) + totals.get('bonuses', 0) + totals.get('earnings', 0)
+                    - totals.get('withdrawals', 0) - spent),
+        'total_earnings': totals.get('earnings', 0),
+        'deposit_amount': totals.get('deposits', 0),
+    }
+
+def _money_diff(user: dict, expected: dict) -> dict:
+    return {
+        field: user.get(field, 0) - expected[field]
+        for field in RECONCILED_FIELDS
+        if abs(user.get(field, 0) - expected[field]) > RECONCILE_TOLERANCE_CENTS
+    }
+
+class ReconcileContext:
+    def __init__(self, run_id: str, archives: List[str], animal_prices: dict):
+        self.run_id = run_id
+        self.archives = archives
+        self.animal_prices = animal_prices
+
+    def ledger(self, id_filter: dict):
+        return db.transactions.aggregate(_ledger_totals_pipeline(id_filter, self.archives), allowDiskUse=True)
+
+    def farms(self, id_filter: dict):
+        return db.user_farms.aggregate(_farm_spend_pipeline(id_filter, self.animal_prices), allowDiskUse=True)
+
+    async def recheck(self, suspects: List[dict]) -> List[dict]:
+        """Recompute suspects once more: writes in flight while the partition was
+        streaming (or an archive move) would otherwise show up as drift."""
+        ids = [suspect['user_id'] for suspect in suspects]
+        totals = {row['_id']: row async for row in self.ledger({'$in': ids})}
+        farms = {row['_id']: row async for row in self.farms({'$in': ids})}
+        users = {user['id']: user async for user in db.users.find(
+            {'id': {'$in': ids}}, {'_id': 0, 'id': 1, **{field: 1 for field in RECONCILED_FIELDS}}
+        )}
+        confirmed = []
+        for user_id in ids:
+            user = users.get(user_id)
+            if user is None:
+                if user_id in totals:
+                    confirmed.append({'user_id': user_id, 'kind': 'orphan_ledger', 'rows': totals[user_id]['rows']})
+                continue
+            expected = expected_user_money(totals.get(user_id), farms.get(user_id))
+            diff = _money_diff(user, expected)
+            if diff:
+                confirmed.append({
+                    'user_id': user_id,
+                    'kind': 'mismatch',
+                    'stored': {field: user.get(field, 0) for field in RECONCILED_FIELDS},
+                    'expected': expected,
+                    'diff': diff,
+                    'estimated_farm_prices': farms.get(user_id, {}).get('estimated', 0),
+                })
+        return confirmed
+
+    async def write(self, suspects: List[dict]) -> int:
+        confirmed = await self.recheck(suspects)
+        if confirmed:
+            await db.reconciliation_discrepancies.insert_many([
+                {'run_id': self.run_id, **discrepancy} for discrepancy in confirmed
+            ])
+        return len(confirmed)
+
+    async def partition(self, id_range: dict) -> dict:
+        stats = {'users': 0, 'discrepancies': 0}
+        ledger, farms = self.ledger(id_range), self.farms(id_range)
+        ledger_row, farm_row = await anext(ledger, None), await anext(farms, None)
+        suspects = []
+        users = db.users.find(
+            {'id': id_range}, {'_id': 0, 'id': 1, **{field: 1 for field in RECONCILED_FIELDS}}
+        ).sort('id', 1)
+        async for user in users:
+            # Ledger groups with no matching user sort before it; flag them as orphans
+            while ledger_row is not None and ledger_row['_id'] < user['id']:
+                suspects.append({'user_id': ledger_row['_id']})
+                ledger_row = await anext(ledger, None)
+            while farm_row is not None and farm_row['_id'] < user['id']:
+                farm_row = await anext(farms, None)
+            totals = ledger_row if ledger_row is not None and ledger_row['_id'] == user['id'] else None
+            spend = farm_row if farm_row is not None and farm_row['_id'] == user['id'] else None
+            if totals is not None:
+                ledger_row = await anext(ledger, None)
+            if spend is not None:
+                farm_row = await anext(farms, None)
+            
+            stats['users'] += 1
+            if _money_diff(user, expected_user_money(totals, spend)):
+                suspects.append({'user_id': user['id']})
+            if len(suspects) >= RECONCILE_BATCH_SIZE:
+                stats['discrepancies'] += await self.write(suspects)
+                suspects = []
+        while ledger_row is not None:
+            suspects.append({'user_id': ledger_row['_id']})
+            ledger_row = await anext(ledger, None)
+        if suspects:
+            stats['discrepancies'] += await self.write(suspects)
+        return stats
+
+async def reconcile_balances(run_id: Optional[str] = None) -> dict:
+    """Reconcile every user's money fields against the ledger and store the report."""
+    run_id = run_id or str(uuid.uuid4())
+    started = time.perf_counter()
+    await db.reconciliation_runs.update_one(
+        {'id': run_id},
+        {'$setOnInsert': {'status': 'running', 'started_at': datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    animals = await get_cached_farm_animals()
+    context = ReconcileContext(
+        run_id,
+        await get_archive_collections(),
+        {animal_id: to_cents(animal['price']) for animal_id, animal in animals.items()}
+    )
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    
+    async def run_partition(id_range):
+        async with semaphore:
+            return await context.partition(id_range)
+    
+    try:
+        results = await asyncio.gather(*(run_partition(r) for r in reconcile_partitions(RECONCILE_PARTITIONS)))
+    except Exception as e:
+        await db.reconciliation_runs.update_one({'id': run_id}, {'$set': {'status': 'failed', 'error': str(e)}})
+        raise
+    summary = {
+        'status': 'completed',
+        'users_checked': sum(r['users'] for r in results),
+        'discrepancies': sum(r['discrepancies'] for r in results),
+        'finished_at': datetime.now(timezone.utc).isoformat(),
+        'duration_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+    await db.reconciliation_runs.update_one({'id': run_id}, {'$set': summary})
+    logging.info(f"Reconciled {summary['users_checked']} users: {summary['discrepancies']} discrepancies ({summary['duration_ms']:.0f}ms)")
+    return {'id': run_id, **summary}
+
+@startup_phase('reconciliation')
+async def setup_reconciliation():
+    await db.users.create_index('id')
+    await db.user_farms.create_index('user_id')
+    await db.reconciliation_runs.create_index('id', unique=True)
+    await db.reconciliation_discrepancies.create_index('run_id')
+    if RECONCILE_INTERVAL_HOURS > 0:
+        run_periodic('reconcile_balances', RECONCILE_INTERVAL_HOURS * 3600, reconcile_balances)
 
 # Admin endpoints
 @api_router.get("/admin/users")
@@ -662,8 +2280,38 @@ async def get_all_users(current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    users = await db.users.find({}, {'_id': 0, 'password': 0}).sort('created_at', -1).to_list(1000)
-    return users
+    users = await analytics_db.users.find({}, {'_id': 0, 'password': 0}).sort('created_at', -1).to_list(1000)
+    return [public_user(user) for user in users]
+
+@api_router.post("/admin/users/{user_id}/revoke-tokens")
+async def revoke_user_tokens(user_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    await revocation_list.revoke_user(user_id)
+    return {'success': True}
+
+@api_router.post("/admin/users/{user_id}/ban")
+async def ban_user(user_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    # The flag stops new logins; the revocation ends the sessions already open
+    result = await db.users.update_one({'id': user_id}, {'$set': {'is_banned': True}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="İstifadəçi tapılmadı")
+    await revocation_list.revoke_user(user_id)
+    return {'success': True}
+
+@api_router.post("/admin/users/{user_id}/unban")
+async def unban_user(user_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    result = await db.users.update_one({'id': user_id}, {'$unset': {'is_banned': ''}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="İstifadəçi tapılmadı")
+    return {'success': True}
 
 @api_router.put("/admin/vip-levels/{level}")
 async def update_vip_level(level: int, vip_data: dict, current_user: dict = Depends(get_current_user)):
@@ -675,6 +2323,8 @@ async def update_vip_level(level: int, vip_data: dict, current_user: dict = Depe
         {'$set': vip_data},
         upsert=True
     )
+    await vip_levels_cache.invalidate()
+    spawn_background(_retier_in_background())
     
     return {'success': True}
 
@@ -683,112 +2333,445 @@ async def get_pending_withdrawals(current_user: dict = Depends(get_current_user)
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    withdrawals = await db.transactions.find(
+    withdrawals = await analytics_db.transactions.find(
         {'type': 'withdraw', 'status': 'pending'},
         {'_id': 0}
     ).sort('created_at', -1).to_list(100)
     
     # Get user info for each withdrawal
+    user_ids = list({w['user_id'] for w in withdrawals})
+    users = await analytics_db.users.find({'id': {'$in': user_ids}}, {'_id': 0, 'id': 1, 'login': 1}).to_list(len(user_ids))
+    logins = {u['id']: u['login'] for u in users}
     for w in withdrawals:
-        user = await db.users.find_one({'id': w['user_id']}, {'_id': 0, 'login': 1})
-        w['user_login'] = user['login'] if user else 'Unknown'
+        w['user_login'] = logins.get(w['user_id'], 'Unknown')
     
-    return withdrawals
+    return [public_money(w, 'transactions') for w in withdrawals]
+
+# Pending transaction state transitions
+BULK_BATCH_SIZE = int(os.environ.get('BULK_BATCH_SIZE', '500'))
+TX_BATCH_STALE_SECONDS = float(os.environ.get('TX_BATCH_STALE_SECONDS', '300'))
+# Enough to recognise a batch being settled again, without growing the user document
+CREDITED_BATCHES_KEPT = 20
+
+@startup_phase('transaction_indexes')
+async def ensure_transaction_indexes():
+    await db.transactions.create_index('id')
+    await db.transactions.create_index([('user_id', 1), ('created_at', -1)])
+    await db.transactions.create_index([('type', 1), ('status', 1), ('created_at', -1)])
+    await db.transactions.create_index('batch_id', sparse=True)
+    await db.transactions.create_index([('status', 1), ('processing_at', 1)])
+    await db.transactions.create_index(
+        'source_tx_id', unique=True, partialFilterExpression={'type': 'bonus'}
+    )
+    run_periodic('resume_transaction_batches', TX_BATCH_STALE_SECONDS / 5, resume_transaction_batches)
+
+async def process_pending_transactions(tx_type: str, tx_ids: List[str], new_status: str,
+                                       credit_fields: List[str], admin_note: Optional[str] = None,
+                                       campaign_bonus: bool = False) -> dict:
+    """Move `tx_type` transactions out of `pending` and apply their balance effects.
+
+    The `status: pending` filter makes each transition happen at most once even
+    under concurrent admins; only transactions this call actually moved get
+    their amount `$inc`-ed into `credit_fields` on the owning user. With
+    `campaign_bonus`, the best active campaign's bonus is added to the same
+    balance `$inc` and recorded as a `bonus` transaction. Moved transactions
+    sit in `processing` under a `batch_id` until the batch is settled, so a
+    batch interrupted before that is finished by `resume_transaction_batches`.
+    Returns id -> outcome (`new_status`, 'not_found' or 'already_processed').
+    """
+    outcomes = {}
+    tx_ids = list(dict.fromkeys(tx_ids))
+    for start in range(0, len(tx_ids), BULK_BATCH_SIZE):
+        batch = tx_ids[start:start + BULK_BATCH_SIZE]
+        batch_id = str(uuid.uuid4())
+        claim = {
+            'status': 'processing',
+            'batch_id': batch_id,
+            'processing_at': datetime.now(timezone.utc),
+            'target_status': new_status,
+            'credit_fields': credit_fields,
+            'campaign_bonus': campaign_bonus,
+        }
+        if admin_note is not None:
+            claim['admin_note'] = admin_note
+        
+        await db.transactions.update_many(
+            {'id': {'$in': batch}, 'type': tx_type, 'status': 'pending'},
+            {'$set': claim}
+        )
+        for tx_id in await settle_transaction_batch(batch_id, credit_fields, campaign_bonus):
+            outcomes[tx_id] = new_status
+        remaining = [tx_id for tx_id in batch if tx_id not in outcomes]
+        if remaining:
+            existing = await db.transactions.find(
+                {'id': {'$in': remaining}}, {'_id': 0, 'id': 1}
+            ).to_list(len(remaining))
+            existing_ids = {tx['id'] for tx in existing}
+            for tx_id in remaining:
+                outcomes[tx_id] = 'already_processed' if tx_id in existing_ids else 'not_found'
+    return outcomes
+
+async def settle_transaction_batch(batch_id: str, credit_fields: List[str], campaign_bonus: bool) -> List[str]:
+    """Credit users for a `processing` batch, then complete it; safe to repeat.
+
+    Bonus rows are written (keyed by source transaction) before any user is
+    credited, so a repeat reuses their amounts. Each user update only matches
+    while `batch_id` is not yet in the user's `credited_batches`.
+    """
+    moved = await db.transactions.find(
+        {'batch_id': batch_id, 'type': {'$ne': 'bonus'}},
+        {'_id': 0, 'id': 1, 'user_id': 1, 'amount': 1, 'status': 1}
+    ).to_list(None)
+    pending = [tx for tx in moved if tx['status'] == 'processing']
+    
+    if credit_fields and pending:
+        tiers = vip_tiers(await get_cached_vip_levels()) if 'deposit_amount' in credit_fields else None
+        bonuses = {}
+        if campaign_bonus:
+            async for row in db.transactions.find({'batch_id': batch_id, 'type': 'bonus'}, {'_id': 0}):
+                bonuses[row['source_tx_id']] = row['amount']
+            campaigns = await get_campaign_index()
+            now = datetime.now(timezone.utc).isoformat()
+            bonus_rows = []
+            for tx in pending:
+                if tx['id'] in bonuses:
+                    continue
+                campaign = campaigns.resolve(tx['amount'])
+                if campaign:
+                    bonus = campaigns.bonus(campaign, tx['amount'])
+                    bonuses[tx['id']] = bonus
+                    bonus_rows.append(UpdateOne({'type': 'bonus', 'source_tx_id': tx['id']}, {'$setOnInsert': {
+                        'id': str(uuid.uuid4()),
+                        'user_id': tx['user_id'],
+                        'amount': bonus,
+                        'status': 'processing',
+                        'batch_id': batch_id,
+                        'target_status': 'completed',
+                        'campaign_id': campaign['id'],
+                        'created_at': now,
+                    }}, upsert=True))
+            if bonus_rows:
+                await db.transactions.bulk_write(bonus_rows, ordered=False)
+        
+        credits = {}
+        for tx in pending:
+            inc = credits.setdefault(tx['user_id'], {field: 0 for field in credit_fields})
+            for field in credit_fields:
+                inc[field] += tx['amount']
+            if tx['id'] in bonuses:
+                inc['balance'] = inc.get('balance', 0) + bonuses[tx['id']]
+        await db.users.bulk_write([
+            UpdateOne(
+                {'id': user_id, 'credited_batches': {'$ne': batch_id}},
+                _user_credit_update(inc, tiers, batch_id)
+            ) for user_id, inc in credits.items()
+        ], ordered=True)
+        if tiers:
+            # Deposits may have raised VIP levels
+            await cache_bus.bump('vip_assignments')
+    
+    await db.transactions.update_many(
+        {'batch_id': batch_id, 'status': 'processing'},
+        [
+            {'$set': {'status': '$target_status', 'completed_at': datetime.now(timezone.utc).isoformat()}},
+            {'$project': {'target_status': 0, 'credit_fields': 0, 'campaign_bonus': 0, 'processing_at': 0}}
+        ]
+    )
+    return [tx['id'] for tx in moved]
+
+async def resume_transaction_batches() -> int:
+    """Settle batches left in `processing` by a worker that failed mid-way."""
+    stale = datetime.now(timezone.utc) - timedelta(seconds=TX_BATCH_STALE_SECONDS)
+    resumed = 0
+    batch_ids = await db.transactions.distinct(
+        'batch_id', {'status': 'processing', 'processing_at': {'$lt': stale}}
+    )
+    for batch_id in batch_ids:
+        tx = await db.transactions.find_one(
+            {'batch_id': batch_id, 'type': {'$ne': 'bonus'}},
+            {'_id': 0, 'credit_fields': 1, 'campaign_bonus': 1}
+        )
+        if tx is None:
+            continue
+        await settle_transaction_batch(batch_id, tx.get('credit_fields', []), tx.get('campaign_bonus', False))
+        resumed += 1
+    if resumed:
+        logging.warning(f"Resumed {resumed} interrupted transaction batches")
+    return resumed
+
+def _user_credit_update(inc: dict, tiers: Optional[List[tuple]], batch_id: str):
+    """`$inc` for plain credits; with VIP tiers, a pipeline that also raises
+    `vip_level` from the new `deposit_amount` in the same atomic update.
+    Either way `batch_id` is remembered in `credited_batches`."""
+    if not tiers:
+        return {'$inc': inc, '$push': {'credited_batches': {'$each': [batch_id], '$slice': -CREDITED_BATCHES_KEPT}}}
+    return [
+        {'$set': {field: {'$add': [{'$ifNull': [f'${field}', 0]}, amount]} for field, amount in inc.items()}},
+        {'$set': {
+            'vip_level': {'$max': [{'$ifNull': ['$vip_level', 0]}, vip_level_expression(tiers)]},
+            'credited_batches': {'$slice': [
+                {'$concatArrays': [{'$ifNull': ['$credited_batches', []]}, [batch_id]]}, -CREDITED_BATCHES_KEPT
+            ]}
+        }}
+    ]
+
+def _single_transition_result(outcomes: dict, tx_id: str) -> dict:
+    if outcomes[tx_id] == 'not_found':
+        raise HTTPException(status_code=404, detail="Transaction tapılmadı")
+    if outcomes[tx_id] == 'already_processed':
+        raise HTTPException(status_code=400, detail="Transaction artıq emal edilib")
+    return {'success': True}
+
+def _bulk_transition_result(outcomes: dict) -> dict:
+    processed = sum(1 for outcome in outcomes.values() if outcome not in ('not_found', 'already_processed'))
+    return {'success': True, 'processed': processed, 'results': outcomes}
 
 @api_router.post("/admin/withdrawals/{tx_id}/approve")
 async def approve_withdrawal(tx_id: str, current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    now = datetime.now(timezone.utc).isoformat()
-    
-    result = await db.transactions.update_one(
-        {'id': tx_id},
-        {'$set': {'status': 'completed', 'completed_at': now}}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=404, detail="Transaction tapılmadı")
-    
-    return {'success': True}
+    outcomes = await process_pending_transactions('withdraw', [tx_id], 'completed', [])
+    return _single_transition_result(outcomes, tx_id)
 
 @api_router.post("/admin/withdrawals/{tx_id}/reject")
 async def reject_withdrawal(tx_id: str, note: str = "", current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    # Get transaction to refund balance
-    tx = await db.transactions.find_one({'id': tx_id}, {'_id': 0})
-    if not tx:
-        raise HTTPException(status_code=404, detail="Transaction tapılmadı")
-    
-    now = datetime.now(timezone.utc).isoformat()
-    
     # Refund balance
-    await db.users.update_one(
-        {'id': tx['user_id']},
-        {'$inc': {'balance': tx['amount']}}
-    )
-    
-    # Update transaction
-    await db.transactions.update_one(
-        {'id': tx_id},
-        {'$set': {'status': 'rejected', 'completed_at': now, 'admin_note': note}}
-    )
-    
-    return {'success': True}
+    outcomes = await process_pending_transactions('withdraw', [tx_id], 'rejected', ['balance'], admin_note=note)
+    return _single_transition_result(outcomes, tx_id)
 
 @api_router.post("/admin/deposits/{tx_id}/approve")
 async def approve_deposit(tx_id: str, current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    tx = await db.transactions.find_one({'id': tx_id}, {'_id': 0})
-    if not tx:
-        raise HTTPException(status_code=404, detail="Transaction tapılmadı")
-    
-    now = datetime.now(timezone.utc).isoformat()
+    # Add to balance and deposit amount, plus any campaign bonus
+    outcomes = await process_pending_transactions('deposit', [tx_id], 'completed', ['balance', 'deposit_amount'], campaign_bonus=True)
+    return _single_transition_result(outcomes, tx_id)
+
+@api_router.post("/admin/withdrawals/bulk-approve")
+async def bulk_approve_withdrawals(req: BulkTransactionRequest, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    # Add to balance and deposit amount
-    await db.users.update_one(
-        {'id': tx['user_id']},
-        {'$inc': {'balance': tx['amount'], 'deposit_amount': tx['amount']}}
-    )
+    outcomes = await process_pending_transactions('withdraw', req.ids, 'completed', [])
+    return _bulk_transition_result(outcomes)
+
+@api_router.post("/admin/withdrawals/bulk-reject")
+async def bulk_reject_withdrawals(req: BulkTransactionRequest, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    # Update transaction
-    await db.transactions.update_one(
-        {'id': tx_id},
-        {'$set': {'status': 'completed', 'completed_at': now}}
-    )
+    outcomes = await process_pending_transactions('withdraw', req.ids, 'rejected', ['balance'], admin_note=req.note)
+    return _bulk_transition_result(outcomes)
+
+@api_router.post("/admin/deposits/bulk-approve")
+async def bulk_approve_deposits(req: BulkTransactionRequest, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    return {'success': True}
+    outcomes = await process_pending_transactions('deposit', req.ids, 'completed', ['balance', 'deposit_amount'], campaign_bonus=True)
+    return _bulk_transition_result(outcomes)
+
+# Notifications
+# Each notification has one audience: everyone, a list of users, or VIP levels
+# (a segment). Cumulative counters (global, per segment in `counters`, direct
+# on the user) make unread counts a subtraction against the user's last-seen
+# snapshot instead of a scan.
+NOTIFICATIONS_PAGE_SIZE = 50
+
+@startup_phase('notifications')
+async def setup_notifications():
+    async def migrate():
+        seq = 0
+        async for notif in db.notifications.find({}, {'_id': 1}).sort('created_at', 1):
+            seq += 1
+            await db.notifications.update_one({'_id': notif['_id']}, {'$set': {'seq': seq}})
+        total_global = await db.notifications.count_documents({'is_global': True})
+        await db.counters.update_one(
+            {'_id': 'notifications'},
+            {'$max': {'seq': seq, 'global': total_global}},
+            upsert=True
+        )
+        # Existing users start with everything so far already seen, like new registrations
+        await db.users.update_many(
+            {'notification_state': {'$exists': False}},
+            {'$set': {'notification_state': await initial_notification_state()}}
+        )
+        await notifications_cache.invalidate()
+    await run_migration('notification_seq', migrate)
+    await db.notifications.create_index([('seq', -1)])
+    await db.notifications.create_index([('user_ids', 1), ('seq', -1)])
+    await db.notifications.create_index([('vip_levels', 1), ('seq', -1)])
 
 @api_router.post("/admin/notifications")
-async def create_notification(title: str, message: str, current_user: dict = Depends(get_current_user)):
+async def create_notification(
+    title: str,
+    message: str,
+    user_ids: Optional[List[str]] = Query(None),
+    vip_levels: Optional[List[int]] = Query(None),
+    current_user: dict = Depends(get_current_user)
+):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    if user_ids and vip_levels:
+        raise HTTPException(status_code=400, detail="Bildiriş ya istifadəçilərə, ya da VIP səviyyələrinə göndərilir")
+    
+    # Direct notifications are counted on each recipient's document instead
+    inc = {'seq': 1}
+    if vip_levels:
+        inc.update({f'segments.{level}': 1 for level in set(vip_levels)})
+    elif not user_ids:
+        inc['global'] = 1
+    counters = await db.counters.find_one_and_update(
+        {'_id': 'notifications'}, {'$inc': inc}, upsert=True, return_document=ReturnDocument.AFTER
+    )
     
     notif_id = str(uuid.uuid4())
     now = datetime.now(timezone.utc).isoformat()
     
     notif_data = {
         'id': notif_id,
+        'seq': counters['seq'],
         'title': title,
         'message': message,
         'created_at': now,
-        'is_global': True
+        'is_global': not (user_ids or vip_levels)
     }
+    if user_ids:
+        notif_data['user_ids'] = list(set(user_ids))
+    elif vip_levels:
+        notif_data['vip_levels'] = sorted(set(vip_levels))
     await db.notifications.insert_one(notif_data)
+    if user_ids:
+        await db.users.update_many(
+            {'id': {'$in': notif_data['user_ids']}},
+            {'$inc': {'notification_state.direct': 1}}
+        )
+    await notifications_cache.invalidate()
     
-    return {'success': True, 'notification_id': notif_id}
+    return {'success': True, 'notification_id': notif_id, 'seq': notif_data['seq']}
+
+async def _fetch_notification_counters() -> dict:
+    return await db.counters.find_one({'_id': 'notifications'}, {'_id': 0}) or {}
+
+async def initial_notification_state() -> dict:
+    counters = await _fetch_notification_counters()
+    return NotificationState(
+        last_seen_seq=counters.get('seq', 0),
+        global_seen=counters.get('global', 0),
+        segments_seen=counters.get('segments', {}),
+    ).model_dump()
+
+async def get_notification_counters() -> dict:
+    return await notifications_cache.get_or_load('counters', _fetch_notification_counters)
+
+def _shared_audience(vip_level: int) -> dict:
+    return {'$or': [{'is_global': True}, {'vip_levels': vip_level}]}
+
+async def get_shared_notifications(vip_level: int) -> List[dict]:
+    """Latest global + segment notifications for a VIP level, newest first."""
+    async def fetch():
+        return await db.notifications.find(
+            _shared_audience(vip_level), {'_id': 0}
+        ).sort('seq', -1).to_list(NOTIFICATIONS_PAGE_SIZE)
+    return await notifications_cache.get_or_load(f'shared:{vip_level}', fetch)
 
 @api_router.get("/notifications")
-async def get_notifications(current_user: dict = Depends(get_current_user)):
-    notifications = await db.notifications.find(
-        {'is_global': True},
-        {'_id': 0}
-    ).sort('created_at', -1).limit(10).to_list(10)
-    return notifications
+async def get_notifications(request: Request, response: Response, since: int = 0,
+                            payload: dict = Depends(get_token_payload)):
+    # Every new notification bumps the `notifications` version and every VIP
+    # level change bumps `vip_assignments`, so the ETag needs no user lookup
+    not_modified = conditional_response(
+        request, response, 'notifications', 'private, no-cache',
+        variant=f"{cache_bus.version('vip_assignments')}-{payload['user_id']}-{since}"
+    )
+    if not_modified:
+        return not_modified
+    
+    current_user = await db.users.find_one(
+        {'id': payload['user_id']}, {'_id': 0, 'id': 1, 'vip_level': 1, 'notification_state': 1}
+    )
+    if not current_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    vip_level = current_user.get('vip_level', 0)
+    state = current_user.get('notification_state') or {}
+    shared = await get_shared_notifications(vip_level)
+    if len(shared) == NOTIFICATIONS_PAGE_SIZE and shared[-1]['seq'] > since:
+        # The cached page doesn't reach back to `since`
+        shared = await db.notifications.find(
+            {**_shared_audience(vip_level), 'seq': {'$gt': since}}, {'_id': 0}
+        ).sort('seq', -1).to_list(NOTIFICATIONS_PAGE_SIZE)
+    direct = []
+    if state.get('direct'):
+        direct = await db.notifications.find(
+            {'user_ids': current_user['id'], 'seq': {'$gt': since}}, {'_id': 0, 'user_ids': 0}
+        ).sort('seq', -1).to_list(NOTIFICATIONS_PAGE_SIZE)
+    
+    notifications = [n for n in shared if n.get('seq', 0) > since] + direct
+    notifications.sort(key=lambda n: n.get('seq', 0), reverse=True)
+    return notifications[:NOTIFICATIONS_PAGE_SIZE]
+
+@api_router.get("/notifications/unread-count")
+async def get_unread_notification_count(current_user: dict = Depends(get_current_user)):
+    counters = await get_notification_counters()
+    state = current_user.get('notification_state') or {}
+    level = str(current_user.get('vip_level', 0))
+    unread = (
+        max(0, counters.get('global', 0) - state.get('global_seen', 0))
+        + max(0, counters.get('segments', {}).get(level, 0) - state.get('segments_seen', {}).get(level, 0))
+        + max(0, state.get('direct', 0) - state.get('direct_seen', 0))
+    )
+    return {'unread': unread, 'last_seen_seq': state.get('last_seen_seq', 0), 'latest_seq': counters.get('seq', 0)}
+
+@api_router.post("/notifications/seen")
+async def mark_notifications_seen(current_user: dict = Depends(get_current_user)):
+    # Read counters fresh: a stale snapshot would resurface already-seen notifications
+    counters = await _fetch_notification_counters()
+    await db.users.update_one({'id': current_user['id']}, [{'$set': {
+        'notification_state.last_seen_seq': counters.get('seq', 0),
+        'notification_state.global_seen': counters.get('global', 0),
+        'notification_state.segments_seen': {'$literal': counters.get('segments', {})},
+        # Copied inside the update so it can't lag behind a concurrent $inc
+        'notification_state.direct_seen': {'$ifNull': ['$notification_state.direct', 0]},
+    }}])
+    return {'success': True, 'last_seen_seq': counters.get('seq', 0)}
+
+# Campaign engine
+class CampaignIndex:
+    """Active campaigns sorted by `min_deposit` for binary-search resolution.
+
+    A deposit gets the campaign with the highest threshold it reaches (the
+    most specific tier); among equal thresholds the larger fixed bonus wins.
+    """
+
+    def __init__(self, campaigns: List[dict]):
+        active = [c for c in campaigns if c.get('is_active')]
+        active.sort(key=lambda c: (to_cents(c.get('min_deposit') or 0), to_cents(c.get('bonus_amount') or 0)))
+        self.campaigns = active
+        self.thresholds = [to_cents(c.get('min_deposit') or 0) for c in active]
+
+    def resolve(self, amount: int) -> Optional[dict]:
+        i = bisect_right(self.thresholds, amount)
+        return self.campaigns[i - 1] if i else None
+
+    @staticmethod
+    def bonus(campaign: dict, amount: int) -> int:
+        percent = Decimal(str(campaign.get('discount_percent') or 0))
+        percent_bonus = int((amount * percent / 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+        return to_cents(campaign.get('bonus_amount') or 0) + percent_bonus
+
+campaigns_cache = ProcessCache(cache_bus, 'campaigns')
+
+async def _fetch_campaign_index() -> CampaignIndex:
+    campaigns = await db.campaigns.find({'is_active': True}, {'_id': 0}).to_list(None)
+    return CampaignIndex(campaigns)
+
+async def get_campaign_index() -> CampaignIndex:
+    return await campaigns_cache.get_or_load('active', _fetch_campaign_index)
 
 @api_router.get("/admin/campaigns")
 async def get_campaigns(current_user: dict = Depends(get_current_user)):
@@ -818,6 +2801,7 @@ async def create_campaign(campaign_data: dict, current_user: dict = Depends(get_
     }
     
     await db.campaigns.insert_one(campaign)
+    await campaigns_cache.invalidate()
     return {'success': True, 'campaign_id': campaign_id}
 
 @api_router.put("/admin/campaigns/{campaign_id}")
@@ -829,6 +2813,7 @@ async def update_campaign(campaign_id: str, update_data: dict, current_user: dic
         {'id': campaign_id},
         {'$set': update_data}
     )
+    await campaigns_cache.invalidate()
     return {'success': True}
 
 @api_router.delete("/admin/campaigns/{campaign_id}")
@@ -837,6 +2822,7 @@ async def delete_campaign(campaign_id: str, current_user: dict = Depends(get_cur
         raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
     await db.campaigns.delete_one({'id': campaign_id})
+    await campaigns_cache.invalidate()
     return {'success': True}
 
 @api_router.post("/admin/vip-levels")
@@ -850,69 +2836,243 @@ async def create_vip_level(vip_data: dict, current_user: dict = Depends(get_curr
         raise HTTPException(status_code=400, detail="Bu səviyyə artıq mövcuddur")
     
     await db.vip_levels.insert_one(vip_data)
+    await vip_levels_cache.invalidate()
+    spawn_background(_retier_in_background())
     return {'success': True}
 
+@api_router.post("/admin/vip-levels/retier")
+async def retier_users(allow_downgrade: bool = VIP_RETIER_DOWNGRADE, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    if not await acquire_job_lease('retier_users', 600):
+        raise HTTPException(status_code=409, detail="Yenidən səviyyələndirmə artıq icra olunur")
+    try:
+        result = await retier_all_users(allow_downgrade)
+    except Exception:
+        await release_job_lease('retier_users')
+        raise
+    if not await _finish_retier():
+        # A level was edited meanwhile; finish its re-tier after responding
+        spawn_background(_retier_until_settled(allow_downgrade))
+    return {'success': True, **result}
+
 # Farm endpoints
+DEFAULT_FARM_ANIMALS = [
+    {'name': 'İnək', 'description': 'Süd istehsalı', 'icon': '🐄', 'price': 500, 'hourly_income': 2.5, 'collect_hours': 4, 'is_active': True},
+    {'name': 'Toyuq', 'description': 'Yumurta istehsalı', 'icon': '🐔', 'price': 200, 'hourly_income': 1.0, 'collect_hours': 2, 'is_active': True},
+    {'name': 'Qoyun', 'description': 'Yun istehsalı', 'icon': '🐑', 'price': 350, 'hourly_income': 1.8, 'collect_hours': 3, 'is_active': True},
+    {'name': 'Keçi', 'description': 'Süd və yun', 'icon': '🐐', 'price': 400, 'hourly_income': 2.0, 'collect_hours': 3, 'is_active': True},
+]
+
+@startup_phase('seed_farm_animals')
+async def seed_farm_animals():
+    async def seed():
+        if await db.farm_animals.count_documents({'is_active': True}) == 0:
+            await db.farm_animals.insert_many([
+                {'id': str(uuid.uuid4()), **animal} for animal in DEFAULT_FARM_ANIMALS
+            ])
+            await farm_animals_cache.invalidate()
+    await run_migration('seed_farm_animals', seed)
+    await db.farm_animals.create_index('id')
+
+async def _fetch_farm_animals():
+    animals = await db.farm_animals.find({}, {'_id': 0}).to_list(100)
+    return {a['id']: a for a in animals}
+
+async def get_cached_farm_animals() -> dict:
+    return await farm_animals_cache.get_or_load('all', _fetch_farm_animals)
+
+# Farm readiness: next-ready times for every farm in a min-heap, popped by one
+# timer task per worker that pushes "ready to collect" events to subscribers.
+FARM_EVENTS_HEARTBEAT = float(os.environ.get('FARM_EVENTS_HEARTBEAT', '15'))
+FARM_EVENTS_TOKEN_SECONDS = int(os.environ.get('FARM_EVENTS_TOKEN_SECONDS', '60'))
+FARM_RESYNC_SECONDS = float(os.environ.get('FARM_RESYNC_SECONDS', '60'))
+FARM_EVENTS_QUEUE_SIZE = 100
+
+class FarmScheduler:
+    """Tracks when each farm is next collectable.
+
+    Entries are keyed by the farm's `last_collect`, so an entry made stale by a
+    collect (on this worker or another) is recognised and replaced on sight.
+    Subscribed users are re-read from Mongo every FARM_RESYNC_SECONDS to pick
+    up collects made through other workers.
+    """
+
+    def __init__(self):
+        self.farms = {}  # farm_id -> (last_collect, ready_ts, user_id, animal_id)
+        self.subscribers = {}  # user_id -> set of event queues
+        self._heap = []  # (ready_ts, farm_id, last_collect)
+        self._wake = asyncio.Event()
+        self._task = None
+
+    def track(self, farm: dict, animal: dict) -> Optional[float]:
+        """Return the farm's ready timestamp, computing it only when last_collect changed."""
+        last_collect = farm.get('last_collect')
+        if not last_collect:
+            return None
+        current = self.farms.get(farm['id'])
+        if current is not None and current[0] == last_collect:
+            return current[1]
+        ready_ts = datetime.fromisoformat(last_collect).timestamp() + animal['collect_hours'] * 3600
+        self.farms[farm['id']] = (last_collect, ready_ts, farm['user_id'], farm['animal_id'])
+        heapq.heappush(self._heap, (ready_ts, farm['id'], last_collect))
+        if self._heap[0][1] == farm['id']:
+            self._wake.set()
+        return ready_ts
+
+    async def sync_users(self, user_ids: List[str]) -> List[tuple]:
+        animals = await get_cached_farm_animals()
+        tracked = []
+        async for farm in db.user_farms.find(
+            {'user_id': {'$in': user_ids}}, {'_id': 0, 'id': 1, 'user_id': 1, 'animal_id': 1, 'last_collect': 1}
+        ):
+            animal = animals.get(farm['animal_id'])
+            if animal:
+                tracked.append((farm, self.track(farm, animal)))
+        return tracked
+
+    async def rebuild(self):
+        """Track every farm; runs in the background at startup."""
+        animals = await get_cached_farm_animals()
+        count = 0
+        async for farm in db.user_farms.find({}, {'_id': 0, 'id': 1, 'user_id': 1, 'animal_id': 1, 'last_collect': 1}):
+            animal = animals.get(farm['animal_id'])
+            if animal and self.track(farm, animal) is not None:
+                count += 1
+        logging.info(f"Farm scheduler tracking {count} farms")
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=FARM_EVENTS_QUEUE_SIZE)
+        self.subscribers.setdefault(user_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue):
+        queues = self.subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self.subscribers[user_id]
+
+    def publish(self, user_id: str, event: dict):
+        for queue in self.subscribers.get(user_id, ()):
+            if not queue.full():
+                queue.put_nowait(event)
+
+    @staticmethod
+    def ready_event(farm_id: str, animal_id: str, ready_ts: float) -> dict:
+        return {
+            'farm_id': farm_id,
+            'animal_id': animal_id,
+            'ready_at': datetime.fromtimestamp(ready_ts, timezone.utc).isoformat()
+        }
+
+    async def _fire(self, farm_id: str):
+        last_collect, ready_ts, user_id, animal_id = self.farms[farm_id]
+        # Confirm against Mongo in case the farm was collected through another worker
+        farm = await db.user_farms.find_one({'id': farm_id}, {'_id': 0, 'id': 1, 'user_id': 1, 'animal_id': 1, 'last_collect': 1})
+        if farm is None:
+            self.farms.pop(farm_id, None)
+            return
+        if farm['last_collect'] != last_collect:
+            animal = (await get_cached_farm_animals()).get(farm['animal_id'])
+            if animal:
+                self.track(farm, animal)
+            return
+        self.publish(user_id, self.ready_event(farm_id, animal_id, ready_ts))
+
+    async def _run(self):
+        last_resync = time.monotonic()
+        while True:
+            try:
+                now = time.time()
+                while self._heap and self._heap[0][0] <= now:
+                    _, farm_id, last_collect = heapq.heappop(self._heap)
+                    current = self.farms.get(farm_id)
+                    if current is None or current[0] != last_collect:
+                        continue  # superseded by a later collect
+                    if current[2] in self.subscribers:
+                        await self._fire(farm_id)
+                if self.subscribers and time.monotonic() - last_resync >= FARM_RESYNC_SECONDS:
+                    await self.sync_users(list(self.subscribers))
+                    last_resync = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.error(f"Farm scheduler error: {str(e)}")
+            timeout = FARM_RESYNC_SECONDS
+            if self._heap:
+                timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def reset(self):
+        """Animal settings changed: recompute every ready time from scratch."""
+        self.farms.clear()
+        self._heap.clear()
+        if self._task is not None:
+            spawn_background(self.rebuild())
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            background_tasks.append(self._task)
+            spawn_background(self.rebuild())
+
+farm_scheduler = FarmScheduler()
+cache_bus.subscribe('farm_animals', farm_scheduler.reset)
+
 @api_router.get("/farm/animals")
-async def get_farm_animals():
-    animals = await db.farm_animals.find({'is_active': True}, {'_id': 0}).to_list(100)
-    if not animals:
-        # Initialize default animals
-        default_animals = [
-            {'id': str(uuid.uuid4()), 'name': 'İnək', 'description': 'Süd istehsalı', 'icon': '🐄', 'price': 500, 'hourly_income': 2.5, 'collect_hours': 4, 'is_active': True},
-            {'id': str(uuid.uuid4()), 'name': 'Toyuq', 'description': 'Yumurta istehsalı', 'icon': '🐔', 'price': 200, 'hourly_income': 1.0, 'collect_hours': 2, 'is_active': True},
-            {'id': str(uuid.uuid4()), 'name': 'Qoyun', 'description': 'Yun istehsalı', 'icon': '🐑', 'price': 350, 'hourly_income': 1.8, 'collect_hours': 3, 'is_active': True},
-            {'id': str(uuid.uuid4()), 'name': 'Keçi', 'description': 'Süd və yun', 'icon': '🐐', 'price': 400, 'hourly_income': 2.0, 'collect_hours': 3, 'is_active': True},
-        ]
-        await db.farm_animals.insert_many(default_animals)
-        animals = default_animals
-    return animals
+async def get_farm_animals(request: Request, response: Response):
+    not_modified = conditional_response(request, response, 'farm_animals', 'public, max-age=60')
+    if not_modified:
+        return not_modified
+    animals = await get_cached_farm_animals()
+    return [a for a in animals.values() if a.get('is_active')]
 
 @api_router.get("/farm/user-farm")
 async def get_user_farm(current_user: dict = Depends(get_current_user)):
     farms = await db.user_farms.find({'user_id': current_user['id']}, {'_id': 0}).to_list(100)
+    animals = await get_cached_farm_animals()
+    now = time.time()
     
     # Add animal details
     for farm in farms:
-        animal = await db.farm_animals.find_one({'id': farm['animal_id']}, {'_id': 0})
+        animal = animals.get(farm['animal_id'])
         if animal:
             farm['animal'] = animal
             
-            # Calculate available to collect
-            if farm.get('last_collect'):
-                last_collect = datetime.fromisoformat(farm['last_collect'])
-                now = datetime.now(timezone.utc)
-                hours_passed = (now - last_collect).total_seconds() / 3600
-                
-                if hours_passed >= animal['collect_hours']:
+            # Readiness comes from the scheduler; it only recomputes after a collect
+            ready_ts = farm_scheduler.track(farm, animal)
+            if ready_ts is not None:
+                if now >= ready_ts:
                     farm['can_collect'] = True
                     farm['available_amount'] = animal['hourly_income'] * animal['collect_hours']
                 else:
                     farm['can_collect'] = False
                     farm['available_amount'] = 0
-                    farm['time_remaining'] = animal['collect_hours'] - hours_passed
+                    farm['time_remaining'] = (ready_ts - now) / 3600
             else:
                 farm['can_collect'] = False
                 farm['available_amount'] = 0
                 farm['time_remaining'] = animal['collect_hours']
     
-    return farms
+    return [public_money(farm, 'user_farms') for farm in farms]
 
 @api_router.post("/farm/buy")
 async def buy_farm_animal(animal_id: str, current_user: dict = Depends(get_current_user)):
-    animal = await db.farm_animals.find_one({'id': animal_id}, {'_id': 0})
+    animal = (await get_cached_farm_animals()).get(animal_id)
     if not animal or not animal.get('is_active'):
         raise HTTPException(status_code=404, detail="Heyvan tapılmadı")
     
-    if current_user['balance'] < animal['price']:
-        raise HTTPException(status_code=400, detail="Balans kifayət deyil")
-    
     # Deduct balance
-    new_balance = current_user['balance'] - animal['price']
-    await db.users.update_one(
-        {'id': current_user['id']},
-        {'$set': {'balance': new_balance}}
-    )
+    price = to_cents(animal['price'])
+    user = await inc_user_money(current_user['id'], {'balance': -price}, guard={'balance': {'$gte': price}})
+    if not user:
+        raise HTTPException(status_code=400, detail="Balans kifayət deyil")
     
     now = datetime.now(timezone.utc).isoformat()
     
@@ -921,13 +3081,15 @@ async def buy_farm_animal(animal_id: str, current_user: dict = Depends(get_curre
         'id': str(uuid.uuid4()),
         'user_id': current_user['id'],
         'animal_id': animal_id,
+        'purchase_price': price,
         'purchased_at': now,
         'last_collect': now,
-        'total_collected': 0.0
+        'total_collected': 0
     }
-    await db.user_farms.insert_one(farm_data)
+    await db.user_farms.insert_one(farm_data.copy())
+    farm_scheduler.track(farm_data, animal)
     
-    return {'success': True, 'new_balance': new_balance, 'farm': farm_data}
+    return {'success': True, 'new_balance': from_cents(user['balance']), 'farm': public_money(farm_data, 'user_farms')}
 
 @api_router.post("/farm/collect/{farm_id}")
 async def collect_farm(farm_id: str, current_user: dict = Depends(get_current_user)):
@@ -935,7 +3097,7 @@ async def collect_farm(farm_id: str, current_user: dict = Depends(get_current_us
     if not farm:
         raise HTTPException(status_code=404, detail="Ferma tapılmadı")
     
-    animal = await db.farm_animals.find_one({'id': farm['animal_id']}, {'_id': 0})
+    animal = (await get_cached_farm_animals()).get(farm['animal_id'])
     if not animal:
         raise HTTPException(status_code=404, detail="Heyvan məlumatı tapılmadı")
     
@@ -949,25 +3111,19 @@ async def collect_farm(farm_id: str, current_user: dict = Depends(get_current_us
             raise HTTPException(status_code=400, detail="Hələ toplamaq vaxtı deyil")
         
         # Calculate income
-        income = animal['hourly_income'] * animal['collect_hours']
-        
-        # Update balances
-        new_balance = current_user['balance'] + income
-        new_total = current_user['total_earnings'] + income
+        income = to_cents(animal['hourly_income'] * animal['collect_hours'])
         
-        await db.users.update_one(
-            {'id': current_user['id']},
-            {'$set': {'balance': new_balance, 'total_earnings': new_total}}
+        # Update farm; matching last_collect makes a concurrent double collect a no-op
+        result = await db.user_farms.update_one(
+            {'id': farm_id, 'last_collect': farm['last_collect']},
+            {'$set': {'last_collect': now.isoformat()}, '$inc': {'total_collected': income}}
         )
+        if result.modified_count == 0:
+            raise HTTPException(status_code=400, detail="Hələ toplamaq vaxtı deyil")
+        farm_scheduler.track({**farm, 'last_collect': now.isoformat()}, animal)
         
-        # Update farm
-        await db.user_farms.update_one(
-            {'id': farm_id},
-            {'$set': {
-                'last_collect': now.isoformat(),
-                'total_collected': farm.get('total_collected', 0) + income
-            }}
-        )
+        # Update balances
+        user = await inc_user_money(current_user['id'], {'balance': income, 'total_earnings': income})
         
         # Create transaction
         tx_data = {
@@ -979,12 +3135,61 @@ async def collect_farm(farm_id: str, current_user: dict = Depends(get_current_us
             'created_at': now.isoformat(),
             'completed_at': now.isoformat()
         }
-        await db.transactions.insert_one(tx_data)
+        await write_behind.insert('transactions', tx_data)
+        await record_daily_earning(current_user['id'], 'farm', income)
+        leaderboard.observe(user)
         
-        return {'success': True, 'collected': income, 'new_balance': new_balance}
+        return {'success': True, 'collected': from_cents(income), 'new_balance': from_cents(user['balance'])}
     else:
         raise HTTPException(status_code=400, detail="Məlumat xətası")
 
+@api_router.post("/farm/events/token")
+async def farm_events_token(payload: dict = Depends(get_token_payload)):
+    token = create_stream_token(payload['user_id'], 'farm_events', FARM_EVENTS_TOKEN_SECONDS)
+    return {'token': token, 'expires_in': FARM_EVENTS_TOKEN_SECONDS}
+
+@api_router.get("/farm/events")
+async def farm_events(token: Optional[str] = None,
+                      credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)):
+    """Server-sent `farm_ready` events for the user's farms, with a heartbeat comment.
+
+    EventSource can't send an Authorization header, so browsers pass a
+    `token` from POST /farm/events/token; it only has to be valid to connect.
+    """
+    if token:
+        payload = verify_stream_token(token, 'farm_events')
+    elif credentials:
+        payload = verify_token(credentials.credentials)
+    else:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    if await revocation_list.is_revoked(payload):
+        raise HTTPException(status_code=401, detail="Token revoked")
+    user_id = payload['user_id']
+    
+    async def stream():
+        queue = farm_scheduler.subscribe(user_id)
+        try:
+            # Farms that are already ready are announced straight away
+            now = time.time()
+            for farm, ready_ts in await farm_scheduler.sync_users([user_id]):
+                if ready_ts is not None and ready_ts <= now:
+                    farm_scheduler.publish(user_id, farm_scheduler.ready_event(farm['id'], farm['animal_id'], ready_ts))
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), FARM_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                yield f"event: farm_ready\ndata: {json.dumps(event)}\n\n"
+        finally:
+            farm_scheduler.unsubscribe(user_id, queue)
+    
+    return StreamingResponse(
+        stream(),
+        media_type='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 # Admin Farm endpoints
 @api_router.get("/admin/farm/animals")
 async def admin_get_animals(current_user: dict = Depends(get_current_user)):
@@ -1012,6 +3217,7 @@ async def admin_create_animal(animal_data: dict, current_user: dict = Depends(ge
     }
     
     await db.farm_animals.insert_one(animal)
+    await farm_animals_cache.invalidate()
     return {'success': True, 'animal_id': animal_id}
 
 @api_router.put("/admin/farm/animals/{animal_id}")
@@ -1023,6 +3229,7 @@ async def admin_update_animal(animal_id: str, animal_data: dict, current_user: d
         {'id': animal_id},
         {'$set': animal_data}
     )
+    await farm_animals_cache.invalidate()
     return {'success': True}
 
 @api_router.delete("/admin/farm/animals/{animal_id}")
@@ -1031,6 +3238,7 @@ async def admin_delete_animal(animal_id: str, current_user: dict = Depends(get_c
         raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
     await db.farm_animals.delete_one({'id': animal_id})
+    await farm_animals_cache.invalidate()
     return {'success': True}
 
 @api_router.get("/admin/stats")
@@ -1038,16 +3246,16 @@ async def get_admin_stats(current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'admin':
         raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
     
-    total_users = await db.users.count_documents({})
-    pending_withdrawals = await db.transactions.count_documents({'type': 'withdraw', 'status': 'pending'})
-    pending_deposits = await db.transactions.count_documents({'type': 'deposit', 'status': 'pending'})
+    total_users = await analytics_db.users.count_documents({})
+    pending_withdrawals = await analytics_db.transactions.count_documents({'type': 'withdraw', 'status': 'pending'})
+    pending_deposits = await analytics_db.transactions.count_documents({'type': 'deposit', 'status': 'pending'})
     
     # Calculate total platform balance
     pipeline = [
         {'$group': {'_id': None, 'total': {'$sum': '$balance'}}}
     ]
-    result = await db.users.aggregate(pipeline).to_list(1)
-    total_balance = result[0]['total'] if result else 0
+    result = await analytics_db.users.aggregate(pipeline).to_list(1)
+    total_balance = from_cents(result[0]['total']) if result else 0
     
     return {
         'total_users': total_users,
@@ -1056,9 +3264,698 @@ async def get_admin_stats(current_user: dict = Depends(get_current_user)):
         'total_platform_balance': total_balance
     }
 
+@api_router.post("/admin/transactions/archive")
+async def run_transaction_archive(older_than_days: int = ARCHIVE_AFTER_DAYS, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    if not await acquire_job_lease('archive_transactions', 3600):
+        raise HTTPException(status_code=409, detail="Arxivləmə artıq icra olunur")
+    try:
+        return await archive_transactions(older_than_days)
+    finally:
+        await release_job_lease('archive_transactions')
+
+@api_router.post("/admin/reconcile")
+async def start_reconciliation(current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    if not await acquire_job_lease('reconcile_balances', 3600):
+        raise HTTPException(status_code=409, detail="Balans yoxlaması artıq icra olunur")
+    run_id = str(uuid.uuid4())
+    
+    async def run():
+        try:
+            await reconcile_balances(run_id)
+        except Exception as e:
+            logging.error(f"Reconciliation {run_id} failed: {str(e)}")
+        finally:
+            await release_job_lease('reconcile_balances')
+    
+    # Minutes on a large ledger, so it runs past the response
+    spawn_background(run())
+    return {'success': True, 'run_id': run_id}
+
+@api_router.get("/admin/reconcile/{run_id}")
+async def get_reconciliation(run_id: str, limit: int = 100, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    run = await analytics_db.reconciliation_runs.find_one({'id': run_id}, {'_id': 0})
+    if not run:
+        raise HTTPException(status_code=404, detail="Yoxlama tapılmadı")
+    discrepancies = await analytics_db.reconciliation_discrepancies.find(
+        {'run_id': run_id}, {'_id': 0, 'run_id': 0}
+    ).to_list(max(1, min(limit, 1000)))
+    for discrepancy in discrepancies:
+        for key in ('stored', 'expected', 'diff'):
+            if key in discrepancy:
+                discrepancy[key] = {field: from_cents(value) for field, value in discrepancy[key].items()}
+    return {**run, 'items': discrepancies}
+
+@api_router.get("/admin/transactions/export")
+async def export_transactions(
+    user_id: Optional[str] = None,
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    current_user: dict = Depends(get_current_user)
+):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    query = {}
+    if user_id:
+        query['user_id'] = user_id
+    if type:
+        query['type'] = type
+    if status:
+        query['status'] = status
+    if date_from or date_to:
+        query['created_at'] = {}
+        if date_from:
+            query['created_at']['$gte'] = date_from
+        if date_to:
+            query['created_at']['$lte'] = date_to
+    
+    async def rows():
+        async for tx in iter_transactions(query, analytics_db):
+            yield json.dumps(public_money(tx, 'transactions'), ensure_ascii=False) + '\n'
+    
+    return StreamingResponse(rows(), media_type='application/x-ndjson')
+
+@api_router.get("/admin/metrics/pool")
+async def get_pool_metrics(current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    return {'pools': [pool_metrics.snapshot(), analytics_pool_metrics.snapshot()]}
+
+# Health and readiness probes
+READY_CACHE_SECONDS = float(os.environ.get('READY_CACHE_SECONDS', '1'))
+READY_MONGO_TIMEOUT = float(os.environ.get('READY_MONGO_TIMEOUT', '1'))
+READY_MAX_LOOP_LAG_MS = float(os.environ.get('READY_MAX_LOOP_LAG_MS', '500'))
+READY_MAX_POOL_UTILIZATION = float(os.environ.get('READY_MAX_POOL_UTILIZATION', '0.95'))
+READY_MAX_QUEUE_FILL = float(os.environ.get('READY_MAX_QUEUE_FILL', '0.9'))
+_ready_cache = {'at': None, 'status_code': 503, 'body': None}
+_ready_lock = asyncio.Lock()
+
+async def probe_mongo() -> dict:
+    start = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.command('ping'), READY_MONGO_TIMEOUT)
+        return {'ok': True, 'latency_ms': round((time.perf_counter() - start) * 1000, 1)}
+    except asyncio.TimeoutError:
+        return {'ok': False, 'error': f'timeout after {READY_MONGO_TIMEOUT:g}s'}
+    except PyMongoError as e:
+        return {'ok': False, 'error': str(e)}
+
+async def run_readiness_probes() -> dict:
+    pool = pool_metrics.snapshot()
+    checks = {
+        'mongo': await probe_mongo(),
+        'event_loop': {
+            'ok': loop_monitor.lag_ms <= READY_MAX_LOOP_LAG_MS,
+            'lag_ms': round(loop_monitor.lag_ms, 1),
+        },
+        'mongo_pool': {
+            # A busy pool is fine; one with a queue of waiters at capacity is not
+            'ok': not (pool['waiting'] > 0 and pool['utilization'] >= READY_MAX_POOL_UTILIZATION),
+            'utilization': pool['utilization'],
+            'waiting': pool['waiting'],
+        },
+        'write_behind': {
+            'ok': write_behind.depth < write_behind.max_size * READY_MAX_QUEUE_FILL,
+            'depth': write_behind.depth,
+        },
+    }
+    return {
+        'status': 'ready' if all(check['ok'] for check in checks.values()) else 'unavailable',
+        'worker': WORKER_ID,
+        'checks': checks,
+    }
+
+@api_router.get("/health")
+async def health():
+    """Liveness: answering at all means the worker's event loop is running."""
+    return {'status': 'ok', 'worker': WORKER_ID}
+
+@api_router.get("/ready")
+async def ready():
+    """Readiness: dependency probes, cached so every worker can be polled each second."""
+    now = time.monotonic()
+    if _ready_cache['at'] is None or now - _ready_cache['at'] >= READY_CACHE_SECONDS:
+        async with _ready_lock:
+            # Concurrent probes wait for the one already in flight
+            if _ready_cache['at'] is None or time.monotonic() - _ready_cache['at'] >= READY_CACHE_SECONDS:
+                body = await run_readiness_probes()
+                _ready_cache.update(
+                    at=time.monotonic(),
+                    status_code=200 if body['status'] == 'ready' else 503,
+                    body=body
+                )
+    return JSONResponse(
+        _ready_cache['body'],
+        status_code=_ready_cache['status_code'],
+        headers={'Cache-Control': 'no-store'}
+    )
+
+# Idempotency keys
+IDEMPOTENCY_TTL_HOURS = int(os.environ.get('IDEMPOTENCY_TTL_HOURS', '24'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+IDEMPOTENCY_LEASE_SECONDS = float(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '60'))
+# Auth responses carry bearer tokens, which must not sit in the store for a day
+IDEMPOTENCY_EXCLUDED_PREFIXES = ('/api/auth/',)
+_idempotency_cache = OrderedDict()
+
+@startup_phase('idempotency_indexes')
+async def ensure_idempotency_indexes():
+    await db.idempotency_keys.create_index('created_at', expireAfterSeconds=IDEMPOTENCY_TTL_HOURS * 3600)
+
+def _replay_response(entry: dict) -> Response:
+    return Response(
+        content=entry['body'],
+        status_code=entry['status_code'],
+        media_type=entry['media_type'],
+        headers={'Idempotent-Replayed': 'true'}
+    )
+
+def _remember_idempotent(key: str, entry: dict):
+    created_at = entry['created_at']
+    if created_at.tzinfo is None:
+        entry = {**entry, 'created_at': created_at.replace(tzinfo=timezone.utc)}
+    _idempotency_cache[key] = entry
+    _idempotency_cache.move_to_end(key)
+    if len(_idempotency_cache) > IDEMPOTENCY_CACHE_SIZE:
+        _idempotency_cache.popitem(last=False)
+
+@app.middleware("http")
+async def idempotency_middleware(request: Request, call_next):
+    """Answer POST retries carrying the same `Idempotency-Key` from the stored response.
+
+    Keys are scoped to the caller's Authorization header and the path, and a
+    key reused with a different request body is refused. The first request
+    claims the key in `idempotency_keys`; a concurrent duplicate gets 409 and
+    5xx outcomes release the claim so the client can retry. A claim left by a
+    worker that died mid-request is taken over once its lease has expired.
+    """
+    idem_key = request.headers.get('idempotency-key')
+    if request.method != 'POST' or not idem_key or request.url.path.startswith(IDEMPOTENCY_EXCLUDED_PREFIXES):
+        return await call_next(request)
+    
+    scope = hashlib.sha256(request.headers.get('authorization', '').encode('utf-8')).hexdigest()[:32]
+    key = f"{scope}:{request.url.path}:{idem_key}"
+    body = await request.body()
+    fingerprint = hashlib.sha256(request.url.query.encode('utf-8') + b'|' + body).hexdigest()
+    
+    now = datetime.now(timezone.utc)
+    entry = _idempotency_cache.get(key)
+    if entry is not None and now - entry['created_at'] >= timedelta(hours=IDEMPOTENCY_TTL_HOURS):
+        # Mongo's TTL index has dropped the stored copy, so the key is free again
+        _idempotency_cache.pop(key, None)
+        entry = None
+    if entry is None:
+        created_at = now
+        try:
+            await db.idempotency_keys.insert_one({
+                '_id': key,
+                'fingerprint': fingerprint,
+                'state': 'in_progress',
+                'created_at': now,
+                'claimed_at': now
+            })
+        except DuplicateKeyError:
+            entry = await db.idempotency_keys.find_one({'_id': key})
+            if entry is None:
+                return JSONResponse(status_code=409, content={'detail': "Sorğu hələ emal olunur"})
+            if entry['state'] == 'done':
+                _remember_idempotent(key, entry)
+            elif entry['fingerprint'] != fingerprint:
+                return JSONResponse(status_code=422, content={'detail': "Idempotency-Key başqa sorğu üçün istifadə olunub"})
+            else:
+                stale = now - timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+                takeover = await db.idempotency_keys.update_one(
+                    {'_id': key, 'state': 'in_progress', '$or': [
+                        {'claimed_at': {'$lt': stale}},
+                        {'claimed_at': {'$exists': False}, 'created_at': {'$lt': stale}}
+                    ]},
+                    {'$set': {'claimed_at': now}}
+                )
+                if takeover.modified_count == 0:
+                    return JSONResponse(status_code=409, content={'detail': "Sorğu hələ emal olunur"})
+                created_at = entry['created_at']
+                entry = None
+    if entry is not None:
+        if entry['fingerprint'] != fingerprint:
+            return JSONResponse(status_code=422, content={'detail': "Idempotency-Key başqa sorğu üçün istifadə olunub"})
+        return _replay_response(entry)
+    
+    try:
+        response = await call_next(request)
+    except Exception:
+        await db.idempotency_keys.delete_one({'_id': key})
+        raise
+    if response.status_code >= 500:
+        await db.idempotency_keys.delete_one({'_id': key})
+        return response
+    
+    response_body = b''.join([chunk async for chunk in response.body_iterator])
+    entry = {
+        'fingerprint': fingerprint,
+        'state': 'done',
+        'status_code': response.status_code,
+        'media_type': response.media_type or response.headers.get('content-type'),
+        'body': response_body
+    }
+    await db.idempotency_keys.update_one({'_id': key}, {'$set': entry})
+    _remember_idempotent(key, {**entry, 'created_at': created_at})
+    return Response(
+        content=response_body,
+        status_code=response.status_code,
+        headers=dict(response.headers),
+        media_type=response.media_type
+    )
+
+# Response compression
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_THREAD_THRESHOLD = int(os.environ.get('COMPRESSION_THREAD_THRESHOLD', str(256 * 1024)))
+COMPRESSION_STREAM_THRESHOLD = int(os.environ.get('COMPRESSION_STREAM_THRESHOLD', str(1024 * 1024)))
+COMPRESSION_LEVEL = int(os.environ.get('COMPRESSION_LEVEL', '6'))
+COMPRESSIBLE_TYPES = ('application/json', 'application/x-ndjson', 'text/')
+compression_metrics = {}
+
+def _pick_encoding(accept_encoding: str) -> Optional[str]:
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        q = 1.0
+        if params.strip().startswith('q='):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    for encoding, available in (('br', brotli), ('zstd', zstandard), ('gzip', gzip)):
+        if available is not None and accepted.get(encoding, 0) > 0:
+            return encoding
+    return None
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=min(COMPRESSION_LEVEL, 11))
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress(body)
+    return gzip.compress(body, compresslevel=min(COMPRESSION_LEVEL, 9))
+
+def _record_compression(route: str, size_in: int, size_out: int):
+    stats = compression_metrics.setdefault(route, {'compressed': 0, 'bytes_in': 0, 'bytes_out': 0})
+    stats['compressed'] += 1
+    stats['bytes_in'] += size_in
+    stats['bytes_out'] += size_out
+
+def _incremental_compressor(encoding: str):
+    """(compress, finish) callables for streamed bodies."""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=min(COMPRESSION_LEVEL, 11))
+        return compressor.process, compressor.finish
+    if encoding == 'zstd':
+        compressor = zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compressobj()
+        return compressor.compress, compressor.flush
+    compressor = zlib.compressobj(min(COMPRESSION_LEVEL, 9), zlib.DEFLATED, 31)
+    return compressor.compress, compressor.flush
+
+class CompressionMiddleware:
+    """Compress responses of allowlisted content types above a size threshold.
+
+    Bodies are buffered up to COMPRESSION_STREAM_THRESHOLD; a complete body is
+    compressed in one go (in a worker thread above COMPRESSION_THREAD_THRESHOLD
+    so big payloads don't stall the event loop), while longer streams such as
+    exports switch to incremental compression.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        headers = dict((k.decode('latin-1').lower(), v.decode('latin-1')) for k, v in scope['headers'])
+        encoding = _pick_encoding(headers.get('accept-encoding', ''))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+        
+        state = {'start': None, 'buffer': [], 'size': 0, 'passthrough': False, 'stream': None, 'out': 0}
+        
+        def compressed_headers(start, length=None):
+            response_headers = []
+            vary = None
+            for k, v in start['headers']:
+                if k.lower() in (b'content-length', b'vary'):
+                    vary = v.decode('latin-1') if k.lower() == b'vary' else vary
+                elif k.lower() == b'etag' and not v.startswith(b'W/'):
+                    # The encoded bytes differ from the identity body, so the validator can't stay strong
+                    response_headers.append((k, b'W/' + v))
+                else:
+                    response_headers.append((k, v))
+            if not vary:
+                vary = 'Accept-Encoding'
+            elif 'accept-encoding' not in vary.lower():
+                vary = f"{vary}, Accept-Encoding"
+            response_headers += [
+                (b'content-encoding', encoding.encode('latin-1')),
+                (b'vary', vary.encode('latin-1')),
+            ]
+            if length is not None:
+                response_headers.append((b'content-length', str(length).encode('latin-1')))
+            return {**start, 'headers': response_headers}
+        
+        def route_name():
+            route = scope.get('route')
+            return route.path if route else scope['path']
+        
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                content_type = next((v for k, v in message['headers'] if k.lower() == b'content-type'), b'')
+                if content_type.startswith(b'text/event-stream'):
+                    # Server-sent events must reach the client as they are produced
+                    state['passthrough'] = True
+                    return await send(message)
+                state['start'] = message
+                return
+            if message['type'] != 'http.response.body' or state['passthrough']:
+                return await send(message)
+            
+            body = message.get('body', b'')
+            more_body = message.get('more_body', False)
+            start = state['start']
+            
+            if state['stream']:
+                compress, finish = state['stream']
+                chunk = compress(body) + (b'' if more_body else finish())
+                state['size'] += len(body)
+                state['out'] += len(chunk)
+                if not more_body:
+                    _record_compression(route_name(), state['size'], state['out'])
+                return await send({'type': 'http.response.body', 'body': chunk, 'more_body': more_body})
+            
+            state['buffer'].append(body)
+            state['size'] += len(body)
+            if more_body and state['size'] < COMPRESSION_STREAM_THRESHOLD:
+                return
+            body = b''.join(state['buffer'])
+            state['buffer'] = []
+            
+            content_type = next((v.decode('latin-1') for k, v in start['headers'] if k.lower() == b'content-type'), '')
+            has_encoding = any(k.lower() == b'content-encoding' for k, _ in start['headers'])
+            if (has_encoding or start['status'] in (204, 304) or not content_type.startswith(COMPRESSIBLE_TYPES)
+                    or (not more_body and len(body) < COMPRESSION_MIN_SIZE)):
+                state['passthrough'] = True
+                await send(start)
+                return await send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+            
+            if more_body:
+                state['stream'] = _incremental_compressor(encoding)
+                chunk = state['stream'][0](body)
+                state['out'] += len(chunk)
+                await send(compressed_headers(start))
+                return await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            
+            if len(body) >= COMPRESSION_THREAD_THRESHOLD:
+                compressed = await asyncio.to_thread(_compress, body, encoding)
+            else:
+                compressed = _compress(body, encoding)
+            _record_compression(route_name(), len(body), len(compressed))
+            await send(compressed_headers(start, len(compressed)))
+            await send({'type': 'http.response.body', 'body': compressed})
+        
+        await self.app(scope, receive, send_wrapper)
+
+@api_router.get("/admin/metrics/compression")
+async def get_compression_metrics(current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    return {
+        route: {**stats, 'bytes_saved': stats['bytes_in'] - stats['bytes_out']}
+        for route, stats in compression_metrics.items()
+    }
+
+@api_router.get("/admin/metrics/loop")
+async def get_loop_metrics(reset: bool = False, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'admin':
+        raise HTTPException(status_code=403, detail="Admin icazəsi tələb olunur")
+    
+    result = {
+        'lag_ms': round(loop_monitor.lag_ms, 1),
+        'max_lag_ms': round(loop_monitor.max_lag_ms, 1),
+        'threshold_ms': loop_monitor.threshold_ms,
+        'blocked': list(loop_monitor.reports),
+    }
+    if reset:
+        # Lets a benchmark run start from a clean slate
+        loop_monitor.reports.clear()
+        loop_monitor.max_lag_ms = 0.0
+    return result
+
+# Batched reads: several GETs in one round trip under one authentication
+BATCH_MAX_REQUESTS = int(os.environ.get('BATCH_MAX_REQUESTS', '20'))
+BATCH_MAX_BODY_BYTES = int(os.environ.get('BATCH_MAX_BODY_BYTES', str(1024 * 1024)))
+BATCH_ITEM_TIMEOUT = float(os.environ.get('BATCH_ITEM_TIMEOUT', '5'))
+BATCH_DROP_HEADERS = (b'content-length', b'content-type', b'accept-encoding', b'if-none-match', b'idempotency-key')
+# Open-ended streams (SSE) never finish, so they can't be part of a batch
+BATCH_STREAMING_TYPES = ('text/event-stream',)
+
+class BatchItem(BaseModel):
+    id: Optional[str] = None
+    path: str
+    params: dict = {}
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+class BatchItemAborted(Exception):
+    """Raised from `send` to stop a sub-response the batch can't carry."""
+
+async def run_batch_item(request: Request, item: BatchItem, payload: dict, user: dict) -> dict:
+    """Run one GET straight through the router with the outer request's user."""
+    path, _, query = item.path.partition('?')
+    result = {'id': item.id, 'path': item.path}
+    if not path.startswith('/api/') or path.rstrip('/') == '/api/batch':
+        return {**result, 'status': 400, 'body': {'detail': "Yalnız /api/ GET sorğuları icazəlidir"}}
+    
+    scope = {
+        **request.scope,
+        'method': 'GET',
+        'path': path,
+        'raw_path': path.encode('utf-8'),
+        'query_string': '&'.join(filter(None, [query, urlencode(item.params, doseq=True)])).encode('latin-1'),
+        'headers': [(k, v) for k, v in request.scope['headers'] if k not in BATCH_DROP_HEADERS],
+        'state': {},
+        'batch': {'payload': payload, 'user': user},
+    }
+    for key in ('route', 'endpoint', 'path_params'):
+        scope.pop(key, None)
+    
+    response = {'status': 500, 'content_type': '', 'body': bytearray(), 'requested': False, 'aborted': None}
+    finished = asyncio.Event()
+    
+    async def receive():
+        if not response['requested']:
+            response['requested'] = True
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+        # Streaming responses listen for a disconnect; only send it once they're done
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+    
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+            response['content_type'] = next(
+                (v.decode('latin-1') for k, v in message['headers'] if k.lower() == b'content-type'), ''
+            )
+            # Raised before the body is iterated, so the stream never subscribes
+            if response['content_type'].startswith(BATCH_STREAMING_TYPES):
+                response['aborted'] = (400, "Axın cavabları batch-də dəstəklənmir")
+                raise BatchItemAborted()
+        elif message['type'] == 'http.response.body':
+            response['body'].extend(message.get('body', b''))
+            if len(response['body']) > BATCH_MAX_BODY_BYTES:
+                response['aborted'] = (413, "Cavab batch üçün çox böyükdür")
+                raise BatchItemAborted()
+            if not message.get('more_body', False):
+                finished.set()
+    
+    try:
+        await request.app.router(scope, receive, send)
+    except StarletteHTTPException as e:
+        # Raised by the router itself, e.g. 404 for an unknown path
+        return {**result, 'status': e.status_code, 'body': {'detail': e.detail}}
+    except Exception as e:
+        # Streaming responses re-raise our abort wrapped in a task group error
+        if response['aborted']:
+            status_code, detail = response['aborted']
+            return {**result, 'status': status_code, 'body': {'detail': detail}}
+        logging.error(f"Batch sub-request {path} failed: {str(e)}")
+        return {**result, 'status': 500, 'body': {'detail': "Internal Server Error"}}
+    
+    body = bytes(response['body'])
+    if response['content_type'].startswith('application/json') and body:
+        body = json.loads(body)
+    else:
+        body = body.decode('utf-8', errors='replace')
+    return {**result, 'status': response['status'], 'body': body}
+
+@api_router.post("/batch")
+async def batch(req: BatchRequest, request: Request, payload: dict = Depends(get_token_payload),
+                current_user: dict = Depends(get_current_user)):
+    if len(req.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"Bir batch-də maksimum {BATCH_MAX_REQUESTS} sorğu ola bilər")
+    
+    async def run(item: BatchItem) -> dict:
+        try:
+            return await asyncio.wait_for(run_batch_item(request, item, payload, current_user), BATCH_ITEM_TIMEOUT)
+        except asyncio.TimeoutError:
+            return {'id': item.id, 'path': item.path, 'status': 504, 'body': {'detail': "Sorğunun vaxtı bitdi"}}
+    
+    responses = await asyncio.gather(*(run(item) for item in req.requests))
+    return {'responses': responses}
+
+# Traffic capture (opt-in), replayed with replay_traffic.py
+TRAFFIC_CAPTURE_DIR = os.environ.get('TRAFFIC_CAPTURE_DIR', '')  # empty disables capture
+TRAFFIC_CAPTURE_SAMPLE = float(os.environ.get('TRAFFIC_CAPTURE_SAMPLE', '1'))
+TRAFFIC_CAPTURE_MAX_BYTES = int(os.environ.get('TRAFFIC_CAPTURE_MAX_BYTES', str(50 * 1024 * 1024)))
+TRAFFIC_CAPTURE_BACKUPS = int(os.environ.get('TRAFFIC_CAPTURE_BACKUPS', '5'))
+TRAFFIC_CAPTURE_MAX_BODY = 64 * 1024
+# Pseudonym key; deliberately separate from JWT_SECRET so captures reveal nothing about it
+TRAFFIC_CAPTURE_SALT = os.environ.get('TRAFFIC_CAPTURE_SALT', '')
+if TRAFFIC_CAPTURE_DIR and not TRAFFIC_CAPTURE_SALT:
+    raise RuntimeError("TRAFFIC_CAPTURE_SALT must be set when TRAFFIC_CAPTURE_DIR is")
+
+traffic_log = logging.getLogger('traffic_capture')
+traffic_log.propagate = False
+_traffic_listener = None
+
+def value_shape(value):
+    """Replace values by their JSON type, keeping only the structure."""
+    if isinstance(value, dict):
+        return {key: value_shape(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [value_shape(value[0])] if value else []
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'num'
+    if value is None:
+        return 'null'
+    return 'str'
+
+def user_pseudonym(headers: dict) -> Optional[str]:
+    auth = headers.get('authorization', '')
+    if not auth.lower().startswith('bearer '):
+        return None
+    try:
+        # Only used to group requests per user; the app itself still verifies the token
+        user_id = jwt.decode(auth[7:], options={'verify_signature': False}).get('user_id')
+    except jwt.PyJWTError:
+        return None
+    if not user_id:
+        return None
+    return hashlib.blake2b(user_id.encode('utf-8'), key=TRAFFIC_CAPTURE_SALT.encode('utf-8')[:64], digest_size=8).hexdigest()
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+class TrafficCaptureMiddleware:
+    """Append one anonymized NDJSON line per request to a rotating capture file.
+
+    Keys: t (epoch start), m (method), r (route template), u (user pseudonym),
+    q/b (query and JSON body shapes), s (status), ms (latency), n (response bytes).
+    No ids, amounts or credentials are written.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or random.random() >= TRAFFIC_CAPTURE_SAMPLE:
+            return await self.app(scope, receive, send)
+        started_at = time.time()
+        start = time.perf_counter()
+        body = bytearray()
+        response = {'status': 500, 'bytes': 0}
+        
+        async def receive_wrapper():
+            message = await receive()
+            if message['type'] == 'http.request' and len(body) < TRAFFIC_CAPTURE_MAX_BODY:
+                body.extend(message.get('body', b''))
+            return message
+        
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                response['status'] = message['status']
+            elif message['type'] == 'http.response.body':
+                response['bytes'] += len(message.get('body', b''))
+            await send(message)
+        
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            route = scope.get('route')
+            headers = dict((k.decode('latin-1').lower(), v.decode('latin-1')) for k, v in scope['headers'])
+            query = dict(parse_qsl(scope.get('query_string', b'').decode('latin-1')))
+            try:
+                body_shape = value_shape(json.loads(body)) if body else None
+            except ValueError:
+                body_shape = 'bytes'
+            record = {
+                't': round(started_at, 3),
+                'm': scope['method'],
+                'r': route.path if route else None,
+                'u': user_pseudonym(headers),
+                'q': {key: 'num' if _is_number(value) else 'str' for key, value in query.items()} or None,
+                'b': body_shape,
+                's': response['status'],
+                'ms': round((time.perf_counter() - start) * 1000, 2),
+                'n': response['bytes'],
+            }
+            traffic_log.info(json.dumps(record, separators=(',', ':')))
+
+def start_traffic_capture():
+    """Write captures from a listener thread so file I/O never runs on the event loop."""
+    global _traffic_listener
+    directory = Path(TRAFFIC_CAPTURE_DIR)
+    directory.mkdir(parents=True, exist_ok=True)
+    file_handler = logging.handlers.RotatingFileHandler(
+        directory / f"traffic-{WORKER_ID.replace(':', '-')}.ndjson",
+        maxBytes=TRAFFIC_CAPTURE_MAX_BYTES,
+        backupCount=TRAFFIC_CAPTURE_BACKUPS
+    )
+    file_handler.setFormatter(logging.Formatter('%(message)s'))
+    records = queue.SimpleQueue()
+    traffic_log.addHandler(logging.handlers.QueueHandler(records))
+    traffic_log.setLevel(logging.INFO)
+    _traffic_listener = logging.handlers.QueueListener(records, file_handler)
+    _traffic_listener.start()
+
+def stop_traffic_capture():
+    global _traffic_listener
+    if _traffic_listener is not None:
+        _traffic_listener.stop()
+        _traffic_listener = None
+        for handler in list(traffic_log.handlers):
+            traffic_log.removeHandler(handler)
+
 # Include router
 app.include_router(api_router)
 
+app.add_middleware(CompressionMiddleware)
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -1067,12 +3964,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if TRAFFIC_CAPTURE_DIR:
+    # Outermost, so recorded latency covers the whole middleware stack
+    app.add_middleware(TrafficCaptureMiddleware)
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
 
+@startup_phase('cache_bus')
+async def start_cache_bus():
+    # Load current versions before serving so the first ETags are right
+    await cache_bus.refresh()
+    cache_bus.start()
+
+@startup_phase('farm_scheduler')
+async def start_farm_scheduler():
+    # After the bus: its first refresh would otherwise reset() the scheduler mid-rebuild
+    await db.user_farms.create_index('id')
+    farm_scheduler.start()
+
+@startup_phase('write_behind')
+async def start_write_behind():
+    write_behind.start()
+
+@startup_phase('loop_monitor')
+async def start_loop_monitor():
+    loop_monitor.start()
+
+@startup_phase('traffic_capture')
+async def start_traffic_capture_phase():
+    if TRAFFIC_CAPTURE_DIR:
+        start_traffic_capture()
+
+@app.on_event("startup")
+async def run_startup_phases():
+    boot_start = time.perf_counter()
+    timings = [('import', (boot_start - _MODULE_T0) * 1000)]
+    for name, phase in startup_phases:
+        phase_start = time.perf_counter()
+        await phase()
+        timings.append((name, (time.perf_counter() - phase_start) * 1000))
+    total_ms = (time.perf_counter() - _MODULE_T0) * 1000
+    report = ', '.join(f"{name}={ms:.1f}ms" for name, ms in timings)
+    if total_ms > STARTUP_TARGET_MS:
+        logger.warning(f"Cold start {total_ms:.1f}ms exceeds target {STARTUP_TARGET_MS:.0f}ms ({report})")
+    else:
+        logger.info(f"Cold start {total_ms:.1f}ms ({report})")
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await stop_background_tasks()
+    await loop_monitor.stop()
+    await cache_bus.stop()
+    await write_behind.stop()
+    stop_traffic_capture()
     client.close()
+    analytics_client.close()
@@ -24,6 +24,38 @@ const Home = () => {
     requestFullscreen();
   }, []);
 
+  useEffect(() => {
+    // EventSource can't send the Authorization header, so it connects with a short-lived stream token
+    let source = null;
+    let retry = null;
+    let closed = false;
+
+    const connect = async () => {
+      try {
+        const res = await axios.post(`${API}/farm/events/token`);
+        if (closed) return;
+        source = new EventSource(`${API}/farm/events?token=${encodeURIComponent(res.data.token)}`);
+        source.addEventListener('farm_ready', () => {
+          toast.success('Fermanız toplamağa hazırdır!');
+        });
+        source.onerror = () => {
+          // The token is only valid briefly, so reconnect with a fresh one
+          source.close();
+          if (!closed) retry = setTimeout(connect, 5000);
+        };
+      } catch (error) {
+        if (!closed) retry = setTimeout(connect, 30000);
+      }
+    };
+
+    connect();
+    return () => {
+      closed = true;
+      clearTimeout(retry);
+      if (source) source.close();
+    };
+  }, []);
+
   const requestFullscreen = () => {
     if (document.documentElement.requestFullscreen && !document.fullscreenElement) {
       document.documentElement.requestFullscreen().catch(() => {});
@@ -32,16 +64,24 @@ const Home = () => {
 
   const fetchData = async () => {
     try {
-      const [vipRes, notifRes, userRes] = await Promise.all([
-        axios.get(`${API}/vip/levels`),
-        axios.get(`${API}/notifications`),
-        axios.get(`${API}/auth/me`)
-      ]);
+      // One round trip for all three reads
+      const batchRes = await axios.post(`${API}/batch`, {
+        requests: [
+          { path: '/api/vip/levels' },
+          { path: '/api/notifications' },
+          { path: '/api/auth/me' }
+        ]
+      });
+      const failed = batchRes.data.responses.find(r => r.status !== 200);
+      if (failed) {
+        throw new Error(`${failed.path}: ${failed.status}`);
+      }
+      const [vipRes, notifRes, userRes] = batchRes.data.responses.map(r => ({ data: r.body }));
       
       setVipLevels(vipRes.data);
       
       // YALNIZ admin bildirişləri
-      const adminNotifications = notifRes.data.filter(n => n.is_global && n.title && n.message);
+      const adminNotifications = notifRes.data.filter(n => n.title && n.message);
       setNotifications(adminNotifications);
       
       updateUser(userRes.data);
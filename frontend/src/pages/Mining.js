@@ -82,15 +82,18 @@ const Mining = () => {
     );
   }
 
-  const remaining = 500 - (miningStatus?.tap_count || 0);
-  const progress = ((miningStatus?.tap_count || 0) / 500) * 100;
+  const tapLimit = miningStatus?.mining_tap_limit || 0;
+  const windowHours = miningStatus?.mining_window_hours || 0;
+  const tapReward = miningStatus?.mining_reward || 0;
+  const remaining = Math.max(tapLimit - (miningStatus?.tap_count || 0), 0);
+  const progress = tapLimit > 0 ? Math.min(((miningStatus?.tap_count || 0) / tapLimit) * 100, 100) : 0;
 
   return (
     <div className="min-h-screen pb-28 bg-slate-950">
       {/* Header */}
       <div className="px-6 pt-8 pb-6">
         <h1 className="text-3xl font-bold text-white playfair mb-2">Mayninq</h1>
-        <p className="text-slate-500 text-sm">Hər 6 saatda 500 toxunma</p>
+        <p className="text-slate-500 text-sm">Hər {windowHours} saatda {tapLimit} toxunma</p>
       </div>
 
       <div className="px-6 space-y-6">
@@ -100,7 +103,7 @@ const Mining = () => {
             <div>
               <p className="text-slate-500 text-sm mb-1">Toxunma</p>
               <p className="text-3xl font-bold text-amber-500 playfair" data-testid="tap-count">{miningStatus?.tap_count || 0}</p>
-              <p className="text-slate-600 text-xs">/ 500</p>
+              <p className="text-slate-600 text-xs">/ {tapLimit}</p>
             </div>
             <div className="text-right">
               <p className="text-slate-500 text-sm mb-1">Qalan</p>
@@ -148,7 +151,7 @@ const Mining = () => {
             <div className="absolute inset-2 bg-slate-950 rounded-full flex flex-col items-center justify-center">
               <Coins className="w-20 h-20 text-amber-500 mb-2" strokeWidth={1.5} />
               <p className="text-white text-xl font-bold">TOXUN</p>
-              <p className="text-amber-500 text-sm mt-1">+0.01 USDT</p>
+              <p className="text-amber-500 text-sm mt-1">+{tapReward} USDT</p>
             </div>
           </button>
 
@@ -156,7 +159,7 @@ const Mining = () => {
             <div className="mt-6 text-center">
               <div className="bg-slate-900 border border-yellow-500/30 rounded-2xl p-4">
                 <p className="font-semibold text-yellow-500 mb-1">Limit doldu</p>
-                <p className="text-sm text-slate-400">6 saat sonra yenidən</p>
+                <p className="text-sm text-slate-400">{windowHours} saat sonra yenidən</p>
               </div>
             </div>
           )}
@@ -169,8 +172,8 @@ const Mining = () => {
             <div>
               <p className="font-semibold text-blue-400 mb-2">Necə işləyir?</p>
               <ul className="text-sm text-slate-400 space-y-1">
-                <li>• Gündə 4 dəfə 500 toxunma</li>
-                <li>• Hər toxunmada 0.01 USDT</li>
+                <li>• Hər {windowHours} saatda {tapLimit} toxunma</li>
+                <li>• Hər toxunmada {tapReward} USDT</li>
                 <li>• Dərhal balansa əlavə olunur</li>
               </ul>
             </div>
@@ -187,7 +190,7 @@ const Mining = () => {
             </div>
             <div className="bg-slate-950 p-3 rounded-xl">
               <p className="text-slate-500 text-sm">Qazanc</p>
-              <p className="text-xl font-bold text-green-400">{((miningStatus?.daily_taps || 0) * 0.01).toFixed(2)}</p>
+              <p className="text-xl font-bold text-green-400">{((miningStatus?.daily_taps || 0) * tapReward).toFixed(2)}</p>
             </div>
           </div>
         </div>
@@ -14,6 +14,7 @@ const Orders = () => {
   const [dailyEarnings, setDailyEarnings] = useState(0);
   const [maxEarnings, setMaxEarnings] = useState(0);
   const [rejectTimer, setRejectTimer] = useState(0);
+  const [nextOrdersAt, setNextOrdersAt] = useState(null);
 
   useEffect(() => {
     fetchOrders();
@@ -35,6 +36,7 @@ const Orders = () => {
       setOrders(res.data.orders || []);
       setDailyEarnings(res.data.daily_earnings || 0);
       setMaxEarnings(res.data.max_earnings || 0);
+      setNextOrdersAt(res.data.next_orders_at ? new Date(res.data.next_orders_at) : null);
       
       if (res.data.message) {
         toast.info(res.data.message);
@@ -118,6 +120,11 @@ const Orders = () => {
           <div className="bg-slate-900 border border-slate-800 rounded-3xl p-8 text-center">
             <Package className="w-16 h-16 mx-auto mb-4 text-slate-700" />
             <p className="text-slate-400 font-medium mb-2">Sifariş mövcud deyil</p>
+            {nextOrdersAt && (
+              <p className="text-slate-500 text-sm" data-testid="next-orders-at">
+                Yeni sifarişlər: {nextOrdersAt.toLocaleTimeString()}
+              </p>
+            )}
             <Button onClick={fetchOrders} data-testid="refresh-orders-button" className="mt-4 bg-gradient-to-r from-amber-500 to-amber-600 text-slate-950 font-bold rounded-2xl">
               Yenilə
             </Button>